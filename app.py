@@ -1,11 +1,36 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, url_for, abort, g, has_request_context, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from werkzeug.middleware.proxy_fix import ProxyFix
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql.compiler import InsertmanyvaluesSentinelOpts
 from flasgger import Swagger, swag_from
+import click
 import os
 from dotenv import load_dotenv
 load_dotenv()
 import jwt
 import datetime
+import base64
+import bisect
+import concurrent.futures
+import hashlib
+import hmac
+import io
+import json
+import logging
+import logging.handlers
+import math
+import multiprocessing
+import random
+import re
+import secrets
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from itertools import accumulate, repeat
 from functools import wraps
 
 SECRET_KEY = os.getenv("JWT_SECRET", "dev_jwt_secret")
@@ -16,50 +41,663 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("DATABASE_URL", "sqlite:///loc
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 print("Using DB:", app.config['SQLALCHEMY_DATABASE_URI'])
 
-db = SQLAlchemy(app)
+# За прокси (Render) remote_addr — адрес прокси. ProxyFix берёт клиента из X-Forwarded-For,
+# доверяя ровно TRUSTED_PROXY_HOPS прокси: без прокси заголовок подделывается клиентом
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))
+if TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=TRUSTED_PROXY_HOPS)
+
+# Объекты не истекают после commit — иначе чтение атрибутов после записи делает лишний SELECT
+db = SQLAlchemy(app, session_options={'expire_on_commit': False})
 swagger = Swagger(app)
 
 from werkzeug.security import generate_password_hash, check_password_hash
 
+# --- Пул хеширования паролей ---
+class PasswordPoolBusy(Exception):
+    """Очередь пула хеширования заполнена или задача не уложилась в таймаут."""
+
+
+class PasswordPool:
+    """Медленный KDF выполняется в отдельных процессах, а не в потоке запроса.
+
+    Не больше max_pending задач одновременно (в работе и в очереди); при переполнении
+    или таймауте — PasswordPoolBusy, который превращается в 503 + Retry-After.
+    """
+
+    def __init__(self, size, max_pending, timeout):
+        self.size = size
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max(max_pending, 1))
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            # Пул, созданный до fork (gunicorn --preload), в воркере не работает — создаём заново
+            if self._executor is None or self._pid != os.getpid():
+                # С fork все процессы пула стартуют сразу при первой задаче, до служебного потока
+                # executor'а, и не переимпортируют app.py. spawn — только там, где fork нет
+                method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.size, mp_context=multiprocessing.get_context(method)
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def _reset(self):
+        with self._lock:
+            self._executor = None
+
+    def run(self, fn, *args):
+        if self.size <= 0:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            raise PasswordPoolBusy()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except concurrent.futures.process.BrokenProcessPool:
+            self._slots.release()
+            self._reset()
+            raise PasswordPoolBusy()
+        # Слот освобождается, когда задача действительно завершилась, а не по таймауту
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise PasswordPoolBusy()
+        except concurrent.futures.process.BrokenProcessPool:
+            self._reset()
+            raise PasswordPoolBusy()
+
+
+password_pool = PasswordPool(
+    size=int(os.getenv("PASSWORD_POOL_SIZE", "2")),
+    max_pending=int(os.getenv("PASSWORD_POOL_MAX_PENDING", "8")),
+    timeout=float(os.getenv("PASSWORD_POOL_TIMEOUT", "5"))
+)
+
+
+@app.errorhandler(PasswordPoolBusy)
+def password_pool_busy(e):
+    response = jsonify({"error": "Too many authentication requests, try again later"})
+    response.headers['Retry-After'] = str(math.ceil(password_pool.timeout))
+    return response, 503
+
+
+# --- Политика хеширования паролей ---
+# PASSWORD_HASH_METHOD — метод Werkzeug: "scrypt", "pbkdf2:sha256" или с явной стоимостью
+# ("scrypt:32768:8:1", "pbkdf2:sha256:600000"). Если стоимость не указана и задан
+# PASSWORD_HASH_TARGET_MS, она подбирается замером на этом хосте при старте.
+SCRYPT_MIN_N, SCRYPT_MAX_N = 2 ** 14, 2 ** 17
+PBKDF2_MIN_ITERATIONS = 100_000
+
+
+def parse_hash_method(method):
+    # (параметры, которые должны совпадать, стоимость) — "scrypt:32768:8:1" -> (('scrypt', 8, 1), 32768)
+    parts = method.split(':')
+    try:
+        if parts[0] == 'scrypt' and len(parts) == 4:
+            return ('scrypt', int(parts[2]), int(parts[3])), int(parts[1])
+        if parts[0] == 'pbkdf2' and len(parts) == 3:
+            return ('pbkdf2', parts[1]), int(parts[2])
+    except ValueError:
+        pass
+    return (method,), 0
+
+
+def time_ms(fn, *args, **kwargs):
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    return (time.perf_counter() - start) * 1000
+
+
+def calibrate_hash_method(method, target_ms):
+    if method == 'scrypt':
+        probe_n = SCRYPT_MIN_N
+        elapsed = time_ms(hashlib.scrypt, b'calibration', salt=b'calibration', n=probe_n, r=8, p=1,
+                          maxmem=132 * probe_n * 8)
+        n = probe_n
+        # Время scrypt линейно по n, а n должно быть степенью двойки
+        while n * 2 <= SCRYPT_MAX_N and elapsed * (n * 2) / probe_n <= target_ms:
+            n *= 2
+        return f'scrypt:{n}:8:1'
+    if method.startswith('pbkdf2') and method.count(':') <= 1:
+        digest = method.partition(':')[2] or 'sha256'
+        probe_iterations = 20_000
+        elapsed = time_ms(hashlib.pbkdf2_hmac, digest, b'calibration', b'calibration', probe_iterations)
+        iterations = int(probe_iterations * target_ms / max(elapsed, 1e-3)) // 1000 * 1000
+        return f'pbkdf2:{digest}:{max(iterations, PBKDF2_MIN_ITERATIONS)}'
+    return method
+
+
+def resolve_hash_policy():
+    method = os.getenv("PASSWORD_HASH_METHOD", "scrypt")
+    target_ms = os.getenv("PASSWORD_HASH_TARGET_MS")
+    if target_ms:
+        method = calibrate_hash_method(method, float(target_ms))
+    # Полная строка метода (с умолчаниями Werkzeug) — из префикса реального хеша;
+    # заодно замеряем стоимость одного хеша
+    start = time.perf_counter()
+    full_method = generate_password_hash('calibration', method).split('$', 1)[0]
+    return method, full_method, time.perf_counter() - start
+
+
+PASSWORD_HASH_METHOD, PASSWORD_HASH_POLICY, PASSWORD_HASH_SECONDS = resolve_hash_policy()
+print("Password hash policy:", PASSWORD_HASH_POLICY)
+
+
+def password_hash_outdated(password_hash):
+    # Другой алгоритм или меньшая стоимость; хеши дороже политики не понижаем
+    stored_params, stored_cost = parse_hash_method(password_hash.split('$', 1)[0])
+    policy_params, policy_cost = parse_hash_method(PASSWORD_HASH_POLICY)
+    return stored_params != policy_params or stored_cost < policy_cost
+
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(512), unique=True, nullable=False)
     password_hash = db.Column(db.String(512), nullable=False)
+    role = db.Column(db.String(32), nullable=False, default='user', server_default='user')
+    # Увеличивается при каждом изменении прав — токены со старой версией отклоняются
+    token_version = db.Column(db.Integer, nullable=False, default=1, server_default='1', index=True)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_pool.run(generate_password_hash, password, PASSWORD_HASH_METHOD)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        valid = password_pool.run(check_password_hash, self.password_hash, password)
+        # Пароль известен только сейчас — заодно переводим хеш на текущую политику.
+        # Сохраняет изменение вызывающий код (commit)
+        if valid and password_hash_outdated(self.password_hash):
+            try:
+                self.set_password(password)
+            except PasswordPoolBusy:
+                # Пароль уже проверен: при перегрузке пула обновим хеш при следующем входе
+                pass
+        return valid
+
+
+class RevokedToken(db.Model):
+    """Отозванный JWT. Строки с истёкшим expires_at больше не нужны и удаляются."""
+    id = db.Column(db.Integer, primary_key=True)
+    jti = db.Column(db.String(32), unique=True, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class ApiKey(db.Model):
+    """Долгоживущий ключ для сервисов. Хранится HMAC ключа, поиск — по уникальному префиксу."""
+    id = db.Column(db.Integer, primary_key=True)
+    prefix = db.Column(db.String(16), unique=True, nullable=False)
+    key_hash = db.Column(db.String(64), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    name = db.Column(db.String(100), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+
+class RefreshToken(db.Model):
+    """Ротируемый refresh-токен. Хранится только HMAC токена, сам токен знает клиент."""
+    id = db.Column(db.Integer, primary_key=True)
+    token_hash = db.Column(db.String(64), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    expires_at = db.Column(db.DateTime, nullable=False)
         
 def seed_users():
-    if not User.query.first():  # если таблица пуста
+    # Выбираем только id: до `flask migrate` в старой базе может не быть новых колонок
+    if not db.session.execute(db.select(User.id).limit(1)).first():  # если таблица пуста
         users = [
-            {"username": "admin", "password": "admin"},
-            {"username": "user1", "password": "1234"},
-            {"username": "user2", "password": "abcd"}
+            {"username": "admin", "password": "admin", "role": "admin"},
+            {"username": "user1", "password": "1234", "role": "user"},
+            {"username": "user2", "password": "abcd", "role": "user"}
         ]
         for u in users:
-            user = User(username=u["username"])
+            user = User(username=u["username"], role=u["role"])
             user.set_password(u["password"])
             db.session.add(user)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Другой воркер gunicorn создал пользователей раньше
+            db.session.rollback()
+            print("ℹ️ Users already exist. Skipping seed.")
+            return
         print("✅ Seed users created.")
     else:
         print("ℹ️ Users already exist. Skipping seed.")
         
 # --- Модель ---
+def fold_name(name):
+    # casefold в Python, а не lower() в SQL: lower() в SQLite понимает только ASCII
+    return name.casefold()
+
+
+def with_folded_name(values):
+    if 'name' in values:
+        values['name_folded'] = fold_name(values['name'])
+    return values
+
+
 class Employee(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     surname = db.Column(db.String(100), nullable=False)
     position = db.Column(db.String(100), nullable=False)
     city = db.Column(db.String(100), nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+    # Имя для поиска по префиксу без учёта регистра. При вставке заполняется по name (и для
+    # executemany), при UPDATE — через with_folded_name. casefold может удлинить строку («ß» -> «ss»).
+    # Поиск по префиксу — диапазон, он равен префиксу только при побайтовом сравнении: в Postgres
+    # колонка в collation "C" (en_US и подобные игнорируют пунктуацию: 'a-bc' попало бы в 'ab')
+    name_folded = db.Column(db.String(300).with_variant(postgresql.VARCHAR(300, collation='C'), 'postgresql'),
+                            nullable=False,
+                            default=lambda ctx: fold_name(ctx.get_current_parameters()['name']))
+
+    # Те же индексы создают миграции 1 и 4 — для уже существующих баз
+    __table_args__ = (
+        db.Index('ix_employee_name', 'name'),
+        db.Index('ix_employee_surname_name', 'surname', 'name'),
+        db.Index('ix_employee_name_folded', 'name_folded'),
+        db.Index('ix_employee_city', 'city'),
+        db.Index('ix_employee_position', 'position'),
+    )
+
+
+class ChangeCounter(db.Model):
+    """Счётчик изменений таблицы — увеличивается в той же транзакции, что и запись."""
+    name = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+
+def seed_change_counters():
+    if not db.session.get(ChangeCounter, 'employee'):
+        db.session.add(ChangeCounter(name='employee'))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Другой воркер успел создать счётчик
+            db.session.rollback()
+
+
+def bump_change_counter(name):
+    db.session.execute(
+        db.update(ChangeCounter)
+        .where(ChangeCounter.name == name)
+        .values(value=ChangeCounter.value + 1, updated_at=datetime.datetime.utcnow())
+    )
+
+# --- Миграции ---
+# Версионированные изменения схемы для уже развёрнутых баз. create_all не трогает
+# существующие таблицы, поэтому новые индексы и колонки добавляются только через `flask migrate`.
+# {concurrently} на Postgres превращается в CONCURRENTLY — индекс строится без блокировки записи.
+# Шаг миграции — SQL-строка или функция от соединения.
+def add_column_if_missing(table, column, ddl):
+    def step(conn):
+        if column not in {c['name'] for c in db.inspect(conn).get_columns(table)}:
+            # "user" — зарезервированное слово в Postgres
+            quoted = conn.dialect.identifier_preparer.quote(table)
+            # {collate_c} — побайтовое сравнение; в SQLite оно и так по умолчанию
+            collate_c = ' COLLATE "C"' if conn.dialect.name == 'postgresql' else ''
+            ddl_sql = ddl.format(collate_c=collate_c)
+            conn.execute(db.text(f'ALTER TABLE {quoted} ADD COLUMN {column} {ddl_sql}'))
+    return step
+
+
+def backfill_name_folded(conn, batch_size=10000):
+    # casefold нет в SQL — заполняем пачками из Python
+    while True:
+        rows = conn.execute(db.text(
+            'SELECT id, name FROM employee WHERE name_folded IS NULL LIMIT :limit'
+        ), {'limit': batch_size}).all()
+        if not rows:
+            return
+        conn.execute(db.text('UPDATE employee SET name_folded = :folded WHERE id = :id'),
+                     [{'id': row.id, 'folded': fold_name(row.name)} for row in rows])
+
+
+MIGRATIONS = [
+    (1, 'Employee secondary indexes', [
+        'CREATE INDEX {concurrently} IF NOT EXISTS ix_employee_name ON employee (name)',
+        'CREATE INDEX {concurrently} IF NOT EXISTS ix_employee_surname_name ON employee (surname, name)',
+        'CREATE INDEX {concurrently} IF NOT EXISTS ix_employee_name_lower ON employee (lower(name))',
+        'CREATE INDEX {concurrently} IF NOT EXISTS ix_employee_city ON employee (city)',
+        'CREATE INDEX {concurrently} IF NOT EXISTS ix_employee_position ON employee (position)',
+    ]),
+    (2, 'Employee.updated_at for conditional requests', [
+        add_column_if_missing('employee', 'updated_at', 'TIMESTAMP'),
+        'UPDATE employee SET updated_at = CURRENT_TIMESTAMP WHERE updated_at IS NULL',
+    ]),
+    (3, 'User roles and token versions for stateless authorization', [
+        add_column_if_missing('user', 'role', "VARCHAR(32) NOT NULL DEFAULT 'user'"),
+        add_column_if_missing('user', 'token_version', 'INTEGER NOT NULL DEFAULT 1'),
+        'CREATE INDEX {concurrently} IF NOT EXISTS ix_user_token_version ON "user" (token_version)',
+        # Учётная запись из seed_users получает права администратора
+        'UPDATE "user" SET role = \'admin\' WHERE username = \'admin\'',
+    ]),
+    (4, 'Employee.name_folded for Unicode-aware prefix search', [
+        add_column_if_missing('employee', 'name_folded', 'VARCHAR(300){collate_c}'),
+        backfill_name_folded,
+        'CREATE INDEX {concurrently} IF NOT EXISTS ix_employee_name_folded ON employee (name_folded)',
+        'DROP INDEX {concurrently} IF EXISTS ix_employee_name_lower',
+    ]),
+]
+
+
+def get_schema_version(conn):
+    conn.execute(db.text('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)'))
+    version = conn.execute(db.text('SELECT MAX(version) FROM schema_version')).scalar()
+    return version or 0
+
+
+def run_migrations():
+    postgres = db.engine.dialect.name == 'postgresql'
+    concurrently = 'CONCURRENTLY' if postgres else ''
+    # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        current = get_schema_version(conn)
+        applied = []
+        for version, description, statements in MIGRATIONS:
+            if version <= current:
+                continue
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(db.text(statement.format(concurrently=concurrently)))
+            conn.execute(db.text('INSERT INTO schema_version (version) VALUES (:v)'), {'v': version})
+            applied.append((version, description))
+    return applied
+
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Применить недостающие миграции схемы."""
+    applied = run_migrations()
+    for version, description in applied:
+        print(f"✅ Migration {version}: {description}")
+    if not applied:
+        print("ℹ️ Schema is up to date.")
 
 # --- Создание таблиц ---
 with app.app_context():
     db.create_all()
     seed_users()
+    seed_change_counters()
+
+# --- Межпроцессная инвалидация ---
+# gunicorn запускает несколько воркеров, у каждого свой кэш. Любая запись увеличивает
+# общее «поколение»; воркер, увидевший новое поколение, очищает свой кэш целиком.
+class FileGeneration:
+    """Поколение — размер файла: дозапись с O_APPEND атомарна между процессами одного хоста."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def current(self):
+        try:
+            return os.stat(self.path).st_size
+        except FileNotFoundError:
+            return 0
+
+    def bump(self):
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            os.write(fd, b'.')
+        finally:
+            os.close(fd)
+
+
+class RedisGeneration:
+    """Поколение в Redis (INCR/GET) — для воркеров на разных хостах.
+
+    current() читается на каждом обращении к кэшам и на каждом аутентифицированном
+    запросе, поэтому значение кэшируется на refresh_interval секунд: изменения с
+    других воркеров видны с этой задержкой, свои — сразу.
+    """
+
+    def __init__(self, url, key, refresh_interval):
+        import redis  # необязательная зависимость, нужна только для redis:// URL
+        self.client = redis.Redis.from_url(url)
+        self.key = key
+        self.refresh_interval = refresh_interval
+        self._value = 0
+        self._checked_at = float('-inf')
+
+    def current(self):
+        now = time.monotonic()
+        if now - self._checked_at >= self.refresh_interval:
+            self._value = int(self.client.get(self.key) or 0)
+            self._checked_at = now
+        return self._value
+
+    def bump(self):
+        self._value = int(self.client.incr(self.key))
+        self._checked_at = time.monotonic()
+
+
+GENERATION_REFRESH_INTERVAL = float(os.getenv("GENERATION_REFRESH_INTERVAL", "0.5"))
+
+
+def make_generation_backend(url, name):
+    if url and url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisGeneration(url, f'{name}:generation', GENERATION_REFRESH_INTERVAL)
+    # file://<каталог>, по умолчанию — tmp; имя файла уникально для базы данных
+    directory = url[len('file://'):] if url and url.startswith('file://') else tempfile.gettempdir()
+    return FileGeneration(os.path.join(directory, f'{name}_{database_key()}.gen'))
+
+
+def database_key():
+    # Общие для воркеров файлы различаются по базе данных — несколько приложений на хосте не смешиваются
+    return hashlib.sha1(app.config['SQLALCHEMY_DATABASE_URI'].encode()).hexdigest()[:12]
+
+
+# --- Bloom-фильтр ---
+class BloomFilter:
+    """Битовый массив на capacity элементов с заданной долей ложных срабатываний."""
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = capacity
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        # Двойное хеширование: k позиций из двух 64-битных половин одного дайджеста
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+# --- Кэш сотрудников ---
+class EmployeeCache:
+    """LRU-кэш сериализованных сотрудников с TTL, согласованный между воркерами через поколение."""
+
+    def __init__(self, maxsize, ttl, generation):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.generation = generation
+        self._generation = generation.current()
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _sync(self):
+        # Вызывается под self._lock. Возвращает False, если кэш пришлось сбросить
+        current = self.generation.current()
+        if current == self._generation:
+            return True
+        self._items.clear()
+        self._generation = current
+        return False
+
+    def get(self, key):
+        with self._lock:
+            self._sync()
+            item = self._items.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._items[key]
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            # Поколение сменилось после get() — значение могло устареть, не сохраняем
+            if not self._sync():
+                return
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        # Вызывать после commit: остальные воркеры сбросят кэш при следующем обращении
+        with self._lock:
+            self._items.pop(key, None)
+        self.generation.bump()
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+        self.generation.bump()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._items),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "generation": self._generation
+            }
+
+
+employee_cache = EmployeeCache(
+    maxsize=int(os.getenv("EMPLOYEE_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("EMPLOYEE_CACHE_TTL", "60")),
+    generation=make_generation_backend(os.getenv("CACHE_INVALIDATION_URL"), 'employee_cache')
+)
+
+# --- Условные запросы (ETag / Last-Modified) ---
+_employee_table_version = {'generation': None, 'value': None, 'updated_at': None}
+_employee_table_version_lock = threading.Lock()
+
+
+def employee_table_version():
+    # Счётчик из БД перечитывается, только когда сменилось поколение кэша,
+    # поэтому неизменная коллекция отдаёт 304 без запроса к базе
+    generation = employee_cache.generation.current()
+    with _employee_table_version_lock:
+        if _employee_table_version['generation'] == generation:
+            return _employee_table_version['value'], _employee_table_version['updated_at']
+    row = db.session.execute(
+        db.select(ChangeCounter.value, ChangeCounter.updated_at).where(ChangeCounter.name == 'employee')
+    ).one()
+    with _employee_table_version_lock:
+        _employee_table_version.update(generation=generation, value=row.value, updated_at=row.updated_at)
+    return row.value, row.updated_at
+
+
+def employee_etag(employee):
+    return f"employee-{employee.id}-{employee.updated_at:%Y%m%d%H%M%S%f}"
+
+
+def not_modified(etag, last_modified=None):
+    # If-None-Match приоритетнее If-Modified-Since (RFC 9110)
+    if request.if_none_match:
+        matched = request.if_none_match.contains_weak(etag)
+    elif last_modified and request.if_modified_since:
+        matched = last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None)
+    else:
+        matched = False
+    if not matched:
+        return None
+    return with_validators(Response(status=304), etag, last_modified)
+
+
+def with_validators(response, etag, last_modified=None):
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified.replace(tzinfo=datetime.timezone.utc)
+    return response
+
+# --- Занятые имена пользователей ---
+class UsernameIndex:
+    """Bloom-фильтр существующих username.
+
+    «Нет в фильтре» — имя точно свободно, без запроса к БД; «есть» — подтверждаем
+    запросом по уникальному индексу. Регистрации в других воркерах догружаются
+    по поколению (только строки с id > last_id).
+    """
+
+    def __init__(self, capacity, generation):
+        self.capacity = capacity
+        self.generation = generation
+        self._generation = None
+        self._filter = BloomFilter(capacity)
+        self._last_id = 0
+        self._lock = threading.Lock()
+
+    def sync(self):
+        generation = self.generation.current()
+        with self._lock:
+            if generation == self._generation:
+                return
+            rows = db.session.execute(
+                db.select(User.id, User.username).where(User.id > self._last_id).order_by(User.id)
+            ).all()
+            if self._filter.count + len(rows) > self._filter.capacity:
+                # Фильтр переполнится — пересобираем с запасом
+                rows = db.session.execute(db.select(User.id, User.username).order_by(User.id)).all()
+                self._filter = BloomFilter(max(self.capacity, len(rows) * 2))
+            for row in rows:
+                self._filter.add(row.username)
+                self._last_id = max(self._last_id, row.id)
+            self._generation = generation
+
+    def is_taken(self, username):
+        self.sync()
+        with self._lock:
+            if username not in self._filter:
+                return False
+        return db.session.execute(db.select(User.id).where(User.username == username)).first() is not None
+
+    def add(self, username):
+        with self._lock:
+            self._filter.add(username)
+        self.generation.bump()
+
+
+username_index = UsernameIndex(
+    capacity=int(os.getenv("USERNAME_FILTER_CAPACITY", "100000")),
+    generation=make_generation_backend(os.getenv("CACHE_INVALIDATION_URL"), 'usernames')
+)
+
+with app.app_context():
+    username_index.sync()
 
 # --- Эндпоинты ---
 @app.route('/register', methods=['POST'])
@@ -101,17 +739,193 @@ def register():
     data = request.get_json()
     if not data.get("username") or not data.get("password"):
         return jsonify({"error": "Username and password are required"}), 400
+    # Bloom-фильтр хеширует строку — прочие типы отсекаем до него
+    if not isinstance(data["username"], str):
+        return jsonify({"error": "Username must be a string"}), 400
 
-    if User.query.filter_by(username=data["username"]).first():
+    # Занятое имя отсекаем до медленного хеширования пароля
+    if username_index.is_taken(data["username"]):
         return jsonify({"error": "Username already exists"}), 400
 
     user = User(username=data["username"])
     user.set_password(data["password"])
     db.session.add(user)
-    db.session.commit()
+    # Фильтр мог ещё не знать о регистрации в другом воркере — последнее слово за уникальным индексом
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"error": "Username already exists"}), 400
+    username_index.add(user.username)
     return jsonify({"message": "User registered successfully"}), 201
 
 
+@app.route('/users/available', methods=['GET'])
+@swag_from({
+    'tags': ['Auth'],
+    'summary': 'Проверка, свободен ли username',
+    'parameters': [
+        {'name': 'username', 'in': 'query', 'type': 'string', 'required': True}
+    ],
+    'responses': {
+        200: {
+            'description': 'Результат проверки',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'username': {'type': 'string'},
+                    'available': {'type': 'boolean'}
+                }
+            }
+        },
+        400: {'description': 'Не указан username'}
+    }
+})
+def username_available():
+    username = request.args.get("username")
+    if not username:
+        return jsonify({"error": "Username is required"}), 400
+    return jsonify({"username": username, "available": not username_index.is_taken(username)})
+
+
+# --- Ограничение попыток входа ---
+class TokenBucketLimiter:
+    """Token bucket на ключ: capacity попыток, восстанавливаются за period секунд.
+
+    Состояние — кортеж (токены, время) в OrderedDict; при переполнении вытесняются
+    давно не использованные ключи.
+    """
+
+    def __init__(self, capacity, period, maxsize=100_000):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+
+    def consume(self, key):
+        """0, если попытка разрешена, иначе — через сколько секунд появится токен."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+                self.allowed += 1
+            else:
+                wait = (1 - tokens) / self.rate
+                self.rejected += 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def stats(self):
+        with self._lock:
+            return {
+                "capacity": self.capacity,
+                "period": self.capacity / self.rate,
+                "tracked_keys": len(self._buckets),
+                "allowed": self.allowed,
+                "rejected": self.rejected
+            }
+
+
+class RedisTokenBucketLimiter:
+    """Тот же token bucket в Redis — общий для воркеров и хостов."""
+
+    SCRIPT = """
+    local capacity = tonumber(ARGV[1])
+    local rate = tonumber(ARGV[2])
+    local now = redis.call('TIME')
+    now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + (now - ts) * rate)
+    local wait = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+    else
+        wait = (1 - tokens) / rate
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate))
+    return tostring(wait)
+    """
+
+    def __init__(self, url, name, capacity, period):
+        import redis  # необязательная зависимость, нужна только для redis:// URL
+        self.client = redis.Redis.from_url(url)
+        self.name = name
+        self.capacity = capacity
+        self.rate = capacity / period
+        self._script = self.client.register_script(self.SCRIPT)
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+
+    def consume(self, key):
+        wait = float(self._script(keys=[f'login_limit:{self.name}:{key}'], args=[self.capacity, self.rate]))
+        with self._lock:
+            if wait:
+                self.rejected += 1
+            else:
+                self.allowed += 1
+        return wait
+
+    def stats(self):
+        with self._lock:
+            return {
+                "capacity": self.capacity,
+                "period": self.capacity / self.rate,
+                "allowed": self.allowed,
+                "rejected": self.rejected
+            }
+
+
+def make_login_limiter(name, limit):
+    # limit — "попыток/секунд", например "5/60"
+    capacity, period = (float(x) for x in limit.split('/'))
+    url = os.getenv("LOGIN_RATE_LIMIT_URL")
+    if url:
+        return RedisTokenBucketLimiter(url, name, capacity, period)
+    return TokenBucketLimiter(capacity, period)
+
+
+login_limiters = {
+    'ip': make_login_limiter('ip', os.getenv("LOGIN_RATE_LIMIT_IP", "20/60")),
+    'username': make_login_limiter('username', os.getenv("LOGIN_RATE_LIMIT_USERNAME", "5/60")),
+}
+
+
+def login_rate_limited(username):
+    # Проверяется до поиска пользователя и хеширования — отказ почти ничего не стоит
+    wait = login_limiters['ip'].consume(request.remote_addr or '')
+    if not wait and username:
+        wait = login_limiters['username'].consume(str(username).lower())
+    if not wait:
+        return None
+    response = jsonify({"error": "Too many login attempts, try again later"})
+    response.headers['Retry-After'] = str(math.ceil(wait))
+    return response, 429
+
+
+@app.route('/login/stats', methods=['GET'])
+@swag_from({
+    'tags': ['Auth'],
+    'description': 'Счётчики ограничителя попыток входа текущего воркера',
+    'responses': {
+        200: {'description': 'Статистика по IP и по username'}
+    }
+})
+def login_limiter_stats():
+    return jsonify({name: limiter.stats() for name, limiter in login_limiters.items()})
+
+
 @app.route('/login', methods=['POST'])
 @swag_from({
     'tags': ['Auth'],
@@ -138,51 +952,74 @@ def register():
             'schema': {
                 'type': 'object',
                 'properties': {
-                    'token': {'type': 'string'}
+                    'token': {'type': 'string'},
+                    'refresh_token': {'type': 'string'}
                 }
             }
         },
         401: {
             'description': 'Неверный логин или пароль'
+        },
+        429: {
+            'description': 'Слишком много попыток входа с этого IP или для этого username (см. Retry-After)'
         }
     }
 })
 def login():
     data = request.get_json()
+    limited = login_rate_limited(data.get("username"))
+    if limited:
+        return limited
     user = User.query.filter_by(username=data.get("username")).first()
     if not user or not user.check_password(data.get("password")):
         return jsonify({"error": "Invalid credentials"}), 401
 
-    token = jwt.encode({
+    refresh_token = issue_refresh_token(user.id)
+    # Заодно сохраняется хеш, обновлённый check_password
+    db.session.commit()
+
+    return jsonify({"token": issue_access_token(user), "refresh_token": refresh_token})
+
+
+# --- Refresh-токены ---
+REFRESH_TOKEN_TTL = datetime.timedelta(days=int(os.getenv("REFRESH_TOKEN_TTL_DAYS", "30")))
+
+
+def issue_access_token(user):
+    # Роль, права и версия прав в токене — авторизация без запросов к БД
+    return jwt.encode({
         "user_id": user.id,
+        "role": user.role,
+        "perms": ROLE_PERMISSIONS.get(user.role, []),
+        "ver": user.token_version,
+        "jti": secrets.token_hex(8),
         "exp": datetime.datetime.utcnow() + datetime.timedelta(hours=2)
     }, SECRET_KEY, algorithm="HS256")
 
-    return jsonify({"token": token})
 
-def require_auth(f):
-    @wraps(f)
-    def wrapper(*args, **kwargs):
-        auth = request.headers.get("Authorization", "")
-        if not auth.startswith("Bearer "):
-            return jsonify({"error": "Missing or invalid token"}), 401
-        token = auth.split(" ")[1]
-        try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-            request.user_id = payload["user_id"]  # если нужно использовать потом
-        except jwt.ExpiredSignatureError:
-            return jsonify({"error": "Token expired"}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({"error": "Invalid token"}), 401
-        return f(*args, **kwargs)
-    return wrapper
+def refresh_token_hash(token):
+    return hmac.new(SECRET_KEY.encode(), token.encode(), hashlib.sha256).hexdigest()
 
 
-@app.route('/employee', methods=['POST'])
-@require_auth
+def issue_refresh_token(user_id):
+    now = datetime.datetime.utcnow()
+    # Истёкшие токены пользователя убираем при логине, чтобы таблица не росла
+    db.session.execute(
+        db.delete(RefreshToken).where(RefreshToken.user_id == user_id, RefreshToken.expires_at <= now)
+    )
+    token = secrets.token_urlsafe(32)
+    db.session.add(RefreshToken(token_hash=refresh_token_hash(token), user_id=user_id,
+                                expires_at=now + REFRESH_TOKEN_TTL))
+    return token
+
+
+@app.route('/token/refresh', methods=['POST'])
 @swag_from({
-    'tags': ['Employee'],
-    'description': 'Создание нового сотрудника',
+    'tags': ['Auth'],
+    'summary': 'Обновление токена',
+    'description': 'Обменивает refresh-токен на новый JWT и новый refresh-токен. '
+                   'Старый refresh-токен после этого недействителен; срок жизни цепочки '
+                   'отсчитывается от логина',
     'parameters': [
         {
             'name': 'body',
@@ -191,71 +1028,1048 @@ def require_auth(f):
             'schema': {
                 'type': 'object',
                 'properties': {
-                    'name': {'type': 'string'},
-                    'surname': {'type': 'string'},
-                    'position': {'type': 'string'},
-                    'city': {'type': 'string'}
+                    'refresh_token': {'type': 'string'}
                 },
-                'required': ['name', 'surname', 'position']
+                'required': ['refresh_token']
             }
         }
     ],
     'responses': {
-        201: {
-            'description': 'Сотрудник успешно создан',
+        200: {
+            'description': 'Новая пара токенов',
             'schema': {
                 'type': 'object',
                 'properties': {
-                    'id': {'type': 'integer'},
-                    'message': {'type': 'string'}
+                    'token': {'type': 'string'},
+                    'refresh_token': {'type': 'string'}
                 }
             }
         },
-        400: {
-            'description': 'Отсутствуют обязательные поля',
+        401: {
+            'description': 'Refresh-токен неизвестен, уже использован или истёк'
+        }
+    }
+})
+def refresh_access_token():
+    data = request.get_json(silent=True) or {}
+    old_token = data.get("refresh_token")
+    if not isinstance(old_token, str) or not old_token:
+        return jsonify({"error": "Invalid refresh token"}), 401
+
+    # Ротация одним UPDATE по уникальному индексу: из параллельных запросов
+    # с одним и тем же токеном выигрывает только один
+    new_token = secrets.token_urlsafe(32)
+    rotated = db.session.execute(
+        db.update(RefreshToken)
+        .where(RefreshToken.token_hash == refresh_token_hash(old_token),
+               RefreshToken.expires_at > datetime.datetime.utcnow())
+        .values(token_hash=refresh_token_hash(new_token))
+        .returning(RefreshToken.user_id),
+        execution_options={'synchronize_session': False}
+    ).first()
+    if rotated is None:
+        db.session.rollback()
+        return jsonify({"error": "Invalid refresh token"}), 401
+    db.session.commit()
+
+    # Права берутся заново — после смены роли обновлённый токен получит актуальные claims
+    user = db.session.get(User, rotated.user_id)
+    return jsonify({"token": issue_access_token(user), "refresh_token": new_token})
+
+# --- Кэш проверенных токенов ---
+class TokenCache:
+    """LRU уже проверенных JWT: ключ — дайджест токена, значение — payload.
+
+    Запись живёт не дольше exp токена, поэтому истёкший токен снова проходит
+    через jwt.decode и получает обычную ошибку «Token expired».
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(token):
+        return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+    def get(self, token):
+        key = self.key(token)
+        with self._lock:
+            payload = self._items.get(key)
+            if payload is None or payload.get("exp", 0) <= time.time():
+                if payload is not None:
+                    del self._items[key]
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return payload
+
+    def set(self, token, payload):
+        if self.maxsize <= 0 or "exp" not in payload:
+            return
+        with self._lock:
+            self._items[self.key(token)] = payload
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def discard(self, token):
+        with self._lock:
+            self._items.pop(self.key(token), None)
+
+
+token_cache = TokenCache(maxsize=int(os.getenv("TOKEN_CACHE_SIZE", "10000")))
+
+
+# --- Отзыв токенов ---
+class RevocationList:
+    """Bloom-фильтр отозванных jti, общий для запросов воркера.
+
+    Отрицательный ответ фильтра окончателен — в БД не ходим. Положительный
+    подтверждается запросом по уникальному индексу. Отзыв в другом воркере
+    виден через поколение: при его смене фильтр пересобирается по неистёкшим
+    отзывам. Догружать «строки с id > последнего» нельзя: revoke удаляет
+    истёкшие строки, и SQLite выдаёт их id повторно.
+    """
+
+    def __init__(self, capacity, generation):
+        self.capacity = capacity
+        self.generation = generation
+        self._generation = None
+        self._filter = BloomFilter(capacity)
+        self._lock = threading.Lock()
+
+    def sync(self):
+        generation = self.generation.current()
+        with self._lock:
+            if generation == self._generation:
+                return
+            # Отзывы редки, а строк не больше, чем токенов за время жизни JWT
+            now = datetime.datetime.utcnow()
+            jtis = db.session.execute(
+                db.select(RevokedToken.jti).where(RevokedToken.expires_at > now)
+            ).scalars().all()
+            self._filter = BloomFilter(max(self.capacity, len(jtis) * 2))
+            for jti in jtis:
+                self._filter.add(jti)
+            self._generation = generation
+
+    def is_revoked(self, jti):
+        self.sync()
+        with self._lock:
+            if jti not in self._filter:
+                return False
+        return db.session.execute(db.select(RevokedToken.id).where(RevokedToken.jti == jti)).first() is not None
+
+    def revoke(self, jti, expires_at):
+        now = datetime.datetime.utcnow()
+        db.session.execute(db.delete(RevokedToken).where(RevokedToken.expires_at <= now))
+        if not db.session.execute(db.select(RevokedToken.id).where(RevokedToken.jti == jti)).first():
+            db.session.add(RevokedToken(jti=jti, expires_at=expires_at))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Тот же jti одновременно отозван другим запросом — строка уже есть
+            db.session.rollback()
+        with self._lock:
+            self._filter.add(jti)
+        self.generation.bump()
+
+
+revocation_list = RevocationList(
+    capacity=int(os.getenv("TOKEN_REVOCATION_CAPACITY", "100000")),
+    generation=make_generation_backend(os.getenv("CACHE_INVALIDATION_URL"), 'token_revocation')
+)
+
+
+def is_token_revoked(payload):
+    # Проверяется на каждом запросе, в том числе для токенов из кэша.
+    # Токены без jti выпущены до появления отзыва и отозваны быть не могут
+    jti = payload.get("jti")
+    return bool(jti) and revocation_list.is_revoked(jti)
+
+
+def decode_token(token):
+    payload = token_cache.get(token)
+    if payload is None:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+        token_cache.set(token, payload)
+    return payload
+
+
+# --- API-ключи ---
+# Формат ключа: ik_<prefix>_<secret>. Префикс ищется по уникальному индексу,
+# секрет проверяется HMAC-SHA256 — микросекунды вместо медленного KDF паролей.
+API_KEY_PREFIX = 'ik'
+
+
+def api_key_hash(key):
+    return hmac.new(SECRET_KEY.encode(), key.encode(), hashlib.sha256).hexdigest()
+
+
+def generate_api_key():
+    prefix = secrets.token_hex(6)
+    return prefix, f"{API_KEY_PREFIX}_{prefix}_{secrets.token_urlsafe(32)}"
+
+
+class ApiKeyCache:
+    """Проверенные API-ключи: HMAC ключа -> payload в формате claims JWT.
+
+    Сбрасывается целиком при отзыве любого ключа и при смене прав пользователей.
+    """
+
+    def __init__(self, maxsize, generations):
+        self.maxsize = maxsize
+        self.generations = generations
+        self._generation = None
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def authenticate(self, key):
+        parts = key.split('_', 2)
+        if len(parts) != 3 or parts[0] != API_KEY_PREFIX:
+            return None
+        digest = api_key_hash(key)
+        generation = tuple(g.current() for g in self.generations)
+        with self._lock:
+            if generation != self._generation:
+                self._items.clear()
+                self._generation = generation
+            payload = self._items.get(digest)
+            if payload is not None:
+                self._items.move_to_end(digest)
+                return payload
+
+        row = db.session.execute(
+            db.select(ApiKey.id, ApiKey.key_hash, User.id.label('user_id'), User.role, User.token_version)
+            .join(User, User.id == ApiKey.user_id)
+            .where(ApiKey.prefix == parts[1])
+        ).first()
+        if row is None or not hmac.compare_digest(row.key_hash, digest):
+            return None
+        payload = {
+            "user_id": row.user_id,
+            "role": row.role,
+            "perms": ROLE_PERMISSIONS.get(row.role, []),
+            "ver": row.token_version,
+            "api_key_id": row.id
+        }
+        with self._lock:
+            if generation == self._generation and self.maxsize > 0:
+                self._items[digest] = payload
+                while len(self._items) > self.maxsize:
+                    self._items.popitem(last=False)
+        return payload
+
+
+api_key_generation = make_generation_backend(os.getenv("CACHE_INVALIDATION_URL"), 'api_keys')
+
+
+def require_auth(f):
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        auth = request.headers.get("Authorization", "")
+        api_key = request.headers.get("X-API-Key") or (auth[len("ApiKey "):] if auth.startswith("ApiKey ") else None)
+        if api_key:
+            payload = api_key_cache.authenticate(api_key)
+            if payload is None:
+                return jsonify({"error": "Invalid API key"}), 401
+        else:
+            if not auth.startswith("Bearer "):
+                return jsonify({"error": "Missing or invalid token"}), 401
+            token = auth.split(" ")[1]
+            try:
+                payload = decode_token(token)
+            except jwt.ExpiredSignatureError:
+                return jsonify({"error": "Token expired"}), 401
+            except jwt.InvalidTokenError:
+                return jsonify({"error": "Invalid token"}), 401
+            if is_token_revoked(payload):
+                return jsonify({"error": "Token revoked"}), 401
+        request.user_id = payload["user_id"]  # если нужно использовать потом
+        request.token_payload = payload
+        return f(*args, **kwargs)
+    return wrapper
+
+
+@app.route('/token/revoke', methods=['POST'])
+@require_auth
+@swag_from({
+    'tags': ['Auth'],
+    'summary': 'Выход (отзыв токена)',
+    'description': 'Отзывает текущий JWT до истечения его срока. Если передан refresh_token '
+                   'этого пользователя, он тоже становится недействительным',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': False,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'refresh_token': {'type': 'string'}
+                }
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Токен отозван',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'message': {'type': 'string'}
+                }
+            }
+        },
+        400: {
+            'description': 'Токен выпущен без jti и не может быть отозван'
+        }
+    }
+})
+def revoke_token():
+    payload = request.token_payload
+    if not payload.get("jti"):
+        return jsonify({"error": "Token cannot be revoked, log in again to get a new one"}), 400
+
+    data = request.get_json(silent=True) or {}
+    refresh_token = data.get("refresh_token")
+    if isinstance(refresh_token, str) and refresh_token:
+        db.session.execute(db.delete(RefreshToken).where(
+            RefreshToken.token_hash == refresh_token_hash(refresh_token),
+            RefreshToken.user_id == request.user_id
+        ))
+
+    expires_at = datetime.datetime.utcfromtimestamp(payload["exp"])
+    revocation_list.revoke(payload["jti"], expires_at)
+    return jsonify({"message": "Token revoked"})
+
+
+# --- Роли и права ---
+ROLE_PERMISSIONS = {
+    'admin': ['employees:write', 'users:admin'],
+    'user': ['employees:write'],
+    'viewer': [],
+}
+
+
+class ClaimsVersions:
+    """Текущие token_version пользователей, у которых права менялись.
+
+    Обновляется только при смене поколения, поэтому проверка версии из токена
+    обычно обходится поиском в словаре. Нет в словаре — версия начальная (1).
+    """
+
+    def __init__(self, generation):
+        self.generation = generation
+        self._generation = None
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def is_current(self, user_id, version):
+        generation = self.generation.current()
+        with self._lock:
+            if generation != self._generation:
+                rows = db.session.execute(
+                    db.select(User.id, User.token_version).where(User.token_version > 1)
+                ).all()
+                self._versions = {row.id: row.token_version for row in rows}
+                self._generation = generation
+            return self._versions.get(user_id, 1) == version
+
+
+claims_versions = ClaimsVersions(
+    generation=make_generation_backend(os.getenv("CACHE_INVALIDATION_URL"), 'user_claims')
+)
+
+api_key_cache = ApiKeyCache(
+    maxsize=int(os.getenv("API_KEY_CACHE_SIZE", "10000")),
+    generations=(api_key_generation, claims_versions.generation)
+)
+
+
+def require_permission(permission):
+    """Ставится под @require_auth: проверяет права только по claims токена."""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            payload = request.token_payload
+            if "perms" not in payload:
+                # Токен выпущен до появления claims — права берём из БД
+                user = db.session.get(User, payload["user_id"])
+                permissions = ROLE_PERMISSIONS.get(user.role, []) if user else []
+            elif not claims_versions.is_current(payload["user_id"], payload.get("ver")):
+                return jsonify({"error": "Token claims are outdated, refresh the token"}), 401
+            else:
+                permissions = payload["perms"]
+            if permission not in permissions:
+                return jsonify({"error": "Forbidden", "required_permission": permission}), 403
+            return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@app.route('/users/<int:user_id>/role', methods=['PUT'])
+@require_auth
+@require_permission('users:admin')
+@swag_from({
+    'tags': ['Auth'],
+    'summary': 'Смена роли пользователя',
+    'description': 'Меняет роль и увеличивает версию прав: ранее выданные токены '
+                   'пользователя перестают проходить проверку прав',
+    'parameters': [
+        {'name': 'user_id', 'in': 'path', 'type': 'integer', 'required': True},
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'role': {'type': 'string', 'enum': list(ROLE_PERMISSIONS)}
+                },
+                'required': ['role']
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Роль изменена',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'id': {'type': 'integer'},
+                    'role': {'type': 'string'},
+                    'token_version': {'type': 'integer'}
+                }
+            }
+        },
+        400: {'description': 'Неизвестная роль'},
+        403: {'description': 'Нет права users:admin'},
+        404: {'description': 'Пользователь не найден'}
+    }
+})
+def set_user_role(user_id):
+    data = request.get_json(silent=True) or {}
+    role = data.get("role")
+    if role not in ROLE_PERMISSIONS:
+        return jsonify({"error": "Unknown role", "roles": list(ROLE_PERMISSIONS)}), 400
+
+    updated = db.session.execute(
+        db.update(User).where(User.id == user_id)
+        .values(role=role, token_version=User.token_version + 1)
+        .returning(User.token_version),
+        execution_options={'synchronize_session': False}
+    ).first()
+    if updated is None:
+        db.session.rollback()
+        return jsonify({"error": f"User with id '{user_id}' not found"}), 404
+    db.session.commit()
+    claims_versions.generation.bump()
+
+    return jsonify({"id": user_id, "role": role, "token_version": updated.token_version})
+
+
+@app.route('/api-keys', methods=['POST'])
+@require_auth
+@swag_from({
+    'tags': ['Auth'],
+    'summary': 'Создание API-ключа',
+    'description': 'Выпускает ключ для сервисных клиентов с правами текущего пользователя. '
+                   'Ключ передаётся в заголовке X-API-Key или Authorization: ApiKey <key> '
+                   'и показывается только один раз',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'name': {'type': 'string'}
+                },
+                'required': ['name']
+            }
+        }
+    ],
+    'responses': {
+        201: {
+            'description': 'Ключ создан',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'id': {'type': 'integer'},
+                    'name': {'type': 'string'},
+                    'key': {'type': 'string'}
+                }
+            }
+        },
+        400: {'description': 'Не указано имя ключа'}
+    }
+})
+def create_api_key():
+    data = request.get_json(silent=True) or {}
+    name = data.get("name")
+    if not isinstance(name, str) or not name:
+        return jsonify({"error": "Key name is required"}), 400
+
+    prefix, key = generate_api_key()
+    api_key = ApiKey(prefix=prefix, key_hash=api_key_hash(key), user_id=request.user_id, name=name[:100])
+    db.session.add(api_key)
+    db.session.commit()
+
+    return jsonify({"id": api_key.id, "name": api_key.name, "key": key}), 201
+
+
+@app.route('/api-keys/<int:key_id>', methods=['DELETE'])
+@require_auth
+@swag_from({
+    'tags': ['Auth'],
+    'summary': 'Отзыв API-ключа',
+    'parameters': [
+        {'name': 'key_id', 'in': 'path', 'type': 'integer', 'required': True}
+    ],
+    'responses': {
+        200: {'description': 'Ключ отозван'},
+        404: {'description': 'Ключ не найден или принадлежит другому пользователю'}
+    }
+})
+def delete_api_key(key_id):
+    deleted = db.session.execute(
+        db.delete(ApiKey).where(ApiKey.id == key_id, ApiKey.user_id == request.user_id).returning(ApiKey.id),
+        execution_options={'synchronize_session': False}
+    ).first()
+    if deleted is None:
+        db.session.rollback()
+        return jsonify({"error": f"API key with id '{key_id}' not found"}), 404
+    db.session.commit()
+    api_key_generation.bump()
+    return jsonify({"message": "API key revoked"})
+
+
+# --- Массовое создание пользователей ---
+BULK_HASH_WORKERS = int(os.getenv("BULK_HASH_WORKERS", str(os.cpu_count() or 1)))
+# Должен совпадать с --timeout gunicorn (по умолчанию 30 с): дольше воркер будет убит, ничего не сохранив
+WORKER_TIMEOUT = float(os.getenv("WORKER_TIMEOUT", "30"))
+# Пачка должна хешироваться не дольше половины таймаута воркера при текущей политике хеша
+MAX_BULK_USERS = max(1, min(
+    int(os.getenv("MAX_BULK_USERS", "5000")),
+    int(WORKER_TIMEOUT / 2 * min(BULK_HASH_WORKERS, os.cpu_count() or 1) / max(PASSWORD_HASH_SECONDS, 1e-3))
+))
+
+
+def hash_passwords(passwords):
+    # Отдельный пул на время запроса: общий password_pool ограничен под /login и не должен
+    # забиваться тысячами задач. С fork дочерние процессы не переимпортируют app.py
+    if BULK_HASH_WORKERS <= 1 or len(passwords) < 2:
+        return [generate_password_hash(p, PASSWORD_HASH_METHOD) for p in passwords]
+    method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+    chunksize = max(1, len(passwords) // (BULK_HASH_WORKERS * 4))
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=BULK_HASH_WORKERS, mp_context=multiprocessing.get_context(method)
+    ) as executor:
+        return list(executor.map(generate_password_hash, passwords, repeat(PASSWORD_HASH_METHOD),
+                                 chunksize=chunksize))
+
+
+@app.route('/users/bulk', methods=['POST'])
+@require_auth
+@require_permission('users:admin')
+@swag_from({
+    'tags': ['Auth'],
+    'summary': 'Массовое создание пользователей',
+    'description': 'Хеширует пароли параллельно на всех ядрах и вставляет пользователей одной '
+                   'транзакцией. Элементы с ошибками пропускаются и перечислены в results',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'array',
+                'items': {
+                    'type': 'object',
+                    'properties': {
+                        'username': {'type': 'string'},
+                        'password': {'type': 'string'},
+                        'role': {'type': 'string', 'enum': list(ROLE_PERMISSIONS)}
+                    },
+                    'required': ['username', 'password']
+                }
+            }
+        }
+    ],
+    'responses': {
+        201: {
+            'description': 'Результат по каждому пользователю и пропускная способность',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'created': {'type': 'integer'},
+                    'failed': {'type': 'integer'},
+                    'results': {'type': 'array', 'items': {'type': 'object'}},
+                    'elapsed_seconds': {'type': 'number'},
+                    'hashing_seconds': {'type': 'number'},
+                    'users_per_second': {'type': 'number'}
+                }
+            }
+        },
+        400: {'description': 'Тело не является массивом'},
+        409: {'description': 'Имя заняли параллельно — ничего не создано, запрос можно повторить'},
+        413: {'description': f'Больше {MAX_BULK_USERS} пользователей за запрос'}
+    }
+})
+def create_users_bulk():
+    started = time.perf_counter()
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        return jsonify({"error": "Body must be a JSON array"}), 400
+    if len(items) > MAX_BULK_USERS:
+        return jsonify({"error": f"Too many users, max {MAX_BULK_USERS} per request"}), 413
+
+    results = [None] * len(items)
+    candidates = {}
+    for index, data in enumerate(items):
+        username = data.get("username") if isinstance(data, dict) else None
+        if not isinstance(data, dict) or not isinstance(username, str) or not username \
+                or not isinstance(data.get("password"), str) or not data["password"]:
+            results[index] = {"index": index, "error": "Username and password are required"}
+        elif not isinstance(data.get("role", "user"), str) or data.get("role", "user") not in ROLE_PERMISSIONS:
+            results[index] = {"index": index, "username": username, "error": "Unknown role"}
+        elif username in candidates:
+            results[index] = {"index": index, "username": username, "error": "Duplicate username in request"}
+        else:
+            candidates[username] = index
+
+    # Существующие имена — одним запросом по уникальному индексу
+    if candidates:
+        existing = db.session.execute(
+            db.select(User.username).where(User.username.in_(list(candidates)))
+        ).scalars().all()
+        for username in existing:
+            index = candidates.pop(username)
+            results[index] = {"index": index, "username": username, "error": "Username already exists"}
+
+    indexes = list(candidates.values())
+    hashing_started = time.perf_counter()
+    hashes = hash_passwords([items[i]["password"] for i in indexes])
+    hashing_seconds = time.perf_counter() - hashing_started
+
+    created = 0
+    if indexes:
+        rows = [{
+            "username": items[i]["username"],
+            "password_hash": password_hash,
+            "role": items[i].get("role", "user")
+        } for i, password_hash in zip(indexes, hashes)]
+        try:
+            ids = insert_returning_ids(User, rows)
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({"error": "Some usernames were taken concurrently, nothing was created"}), 409
+        for i, user_id in zip(indexes, ids):
+            results[i] = {"index": i, "username": items[i]["username"], "id": user_id}
+            username_index.add(items[i]["username"])
+        created = len(ids)
+
+    elapsed = time.perf_counter() - started
+    return jsonify({
+        "created": created,
+        "failed": len(items) - created,
+        "results": results,
+        "elapsed_seconds": round(elapsed, 3),
+        "hashing_seconds": round(hashing_seconds, 3),
+        "users_per_second": round(created / elapsed, 1) if elapsed else None
+    }), 201
+
+
+@app.route('/employee', methods=['POST'])
+@require_auth
+@require_permission('employees:write')
+@swag_from({
+    'tags': ['Employee'],
+    'description': 'Создание нового сотрудника',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'name': {'type': 'string'},
+                    'surname': {'type': 'string'},
+                    'position': {'type': 'string'},
+                    'city': {'type': 'string'}
+                },
+                'required': ['name', 'surname', 'position']
+            }
+        }
+    ],
+    'responses': {
+        201: {
+            'description': 'Сотрудник успешно создан',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'id': {'type': 'integer'},
+                    'message': {'type': 'string'}
+                }
+            }
+        },
+        400: {
+            'description': 'Отсутствуют обязательные поля',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string'},
+                    'missing_fields': {
+                        'type': 'array',
+                        'items': {'type': 'string'}
+                    }
+                }
+            }
+        }
+    }
+})
+def create_employee():
+    data = request.get_json()
+
+    required_fields = ['name', 'surname', 'position']
+    missing = [field for field in required_fields if not data.get(field)]
+
+    if missing:
+        return jsonify({
+            "error": "Missing required fields",
+            "missing_fields": missing
+        }), 400
+
+    valid, error_response = validate_employee_data(data)
+    if not valid:
+        return jsonify(error_response), 400
+    
+    new_employee = Employee(
+        name=data['name'],
+        surname=data['surname'],
+        position=data['position'],
+        city=data.get('city')
+    )
+
+    db.session.add(new_employee)
+    bump_change_counter('employee')
+    db.session.commit()
+    employee_cache.invalidate(new_employee.id)
+
+    return jsonify({
+        "id": new_employee.id,
+        "message": "Employee created successfully"
+    }), 201
+
+
+# --- Массовые операции ---
+MAX_BULK_ITEMS = int(os.getenv("MAX_BULK_ITEMS", "10000"))
+
+
+def read_bulk_items():
+    # Тело — JSON-массив или NDJSON (по объекту на строку)
+    if request.mimetype == NDJSON_MIMETYPE:
+        try:
+            return [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+        except ValueError:
+            return None
+    items = request.get_json(silent=True)
+    return items if isinstance(items, list) else None
+
+
+def insert_returning_ids(model, rows):
+    """executemany-INSERT с RETURNING id; id возвращаются в порядке rows."""
+    # Упорядоченный RETURNING без неявного sentinel (SQLite) SQLAlchemy выполняет по INSERT
+    # на строку. Там вставляем многострочными INSERT без порядка и сортируем id: в SQLite
+    # запись идёт под блокировкой базы, и rowid в одной транзакции выдаются по возрастанию
+    if db.engine.dialect.insertmanyvalues_implicit_sentinel & InsertmanyvaluesSentinelOpts.ANY_AUTOINCREMENT:
+        stmt = db.insert(model).returning(model.id, sort_by_parameter_order=True)
+        return db.session.execute(stmt, rows).scalars().all()
+    return sorted(db.session.execute(db.insert(model).returning(model.id), rows).scalars().all())
+
+
+@app.route('/employees/bulk', methods=['POST'])
+@require_auth
+@require_permission('employees:write')
+@swag_from({
+    'tags': ['Employees'],
+    'description': 'Массовое создание сотрудников одной транзакцией. Тело — JSON-массив '
+                   'или NDJSON (Content-Type: application/x-ndjson). Если хотя бы один элемент '
+                   'не прошёл проверку, ничего не создаётся',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'array',
+                'items': {
+                    'type': 'object',
+                    'properties': {
+                        'name': {'type': 'string'},
+                        'surname': {'type': 'string'},
+                        'position': {'type': 'string'},
+                        'city': {'type': 'string'}
+                    },
+                    'required': ['name', 'surname', 'position']
+                }
+            }
+        }
+    ],
+    'responses': {
+        201: {
+            'description': 'Сотрудники созданы',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'ids': {'type': 'array', 'items': {'type': 'integer'}},
+                    'created': {'type': 'integer'},
+                    'message': {'type': 'string'}
+                }
+            }
+        },
+        400: {
+            'description': 'Некорректное тело или ошибки в элементах (errors: [{index, error, ...}])'
+        },
+        413: {
+            'description': f'Больше {MAX_BULK_ITEMS} элементов за запрос'
+        }
+    }
+})
+def create_employees_bulk():
+    items = read_bulk_items()
+    if items is None:
+        return jsonify({"error": "Body must be a JSON array or NDJSON"}), 400
+    if not items:
+        return jsonify({"error": "No employees to create"}), 400
+    if len(items) > MAX_BULK_ITEMS:
+        return jsonify({"error": f"Too many items, max {MAX_BULK_ITEMS} per request"}), 413
+
+    errors = []
+    rows = []
+    now = datetime.datetime.utcnow()
+    for index, data in enumerate(items):
+        if not isinstance(data, dict):
+            errors.append({"index": index, "error": "Item must be an object"})
+            continue
+        valid, error_response = validate_employee_data(data)
+        if not valid:
+            errors.append({"index": index, **error_response})
+            continue
+        # В POST /employee city необязателен, но колонка NOT NULL — без проверки падала бы вся пачка
+        if not data.get('city'):
+            errors.append({"index": index, "error": "Missing required fields", "missing_fields": ["city"]})
+            continue
+        rows.append({
+            'name': data['name'],
+            'surname': data['surname'],
+            'position': data['position'],
+            'city': data['city'],
+            'updated_at': now
+        })
+    if errors:
+        return jsonify({"error": "Validation failed", "errors": errors}), 400
+
+    # executemany + RETURNING: SQLAlchemy склеивает строки в многострочные INSERT (insertmanyvalues)
+    try:
+        ids = insert_returning_ids(Employee, rows)
+        bump_change_counter('employee')
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        app.logger.exception("Bulk employee insert violated a constraint")
+        return jsonify({"error": "Database constraint violated"}), 400
+    employee_cache.clear()
+
+    return jsonify({
+        "ids": ids,
+        "created": len(ids),
+        "message": "Employees created successfully"
+    }), 201
+
+
+def build_bulk_criteria(data):
+    # Выбор строк для массовых операций: список id и/или фильтр, как у GET /employees
+    ids = data.get('ids')
+    filters = data.get('filter')
+    if not ids and not filters:
+        return None, {"error": "Either 'ids' or 'filter' is required"}
+
+    criteria = []
+    if ids is not None:
+        if not isinstance(ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+            return None, {"error": "'ids' must be a list of integers"}
+        if len(ids) > MAX_BULK_ITEMS:
+            return None, {"error": f"Too many ids, max {MAX_BULK_ITEMS} per request"}
+        criteria.append(Employee.id.in_(ids))
+    if filters is not None:
+        if not isinstance(filters, dict):
+            return None, {"error": "'filter' must be an object"}
+        filter_criteria, error_response = build_employee_filters(filters, EMPLOYEE_FILTER_PARAMS)
+        if error_response:
+            return None, error_response
+        criteria += filter_criteria
+    return criteria, None
+
+
+@app.route('/employees', methods=['PATCH'])
+@require_auth
+@require_permission('employees:write')
+@swag_from({
+    'tags': ['Employees'],
+    'description': 'Массовое обновление одним UPDATE ... WHERE по списку id и/или фильтру '
+                   '(те же фильтры, что у GET /employees)',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'ids': {'type': 'array', 'items': {'type': 'integer'}},
+                    'filter': {
+                        'type': 'object',
+                        'properties': {
+                            'city': {'type': 'string'},
+                            'position': {'type': 'string'},
+                            'surname': {'type': 'string'},
+                            'name': {'type': 'string'},
+                            'name_prefix': {'type': 'string'}
+                        }
+                    },
+                    'set': {
+                        'type': 'object',
+                        'properties': {
+                            'name': {'type': 'string'},
+                            'surname': {'type': 'string'},
+                            'position': {'type': 'string'},
+                            'city': {'type': 'string'}
+                        }
+                    }
+                },
+                'required': ['set']
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Количество обновлённых сотрудников',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'updated': {'type': 'integer'},
+                    'message': {'type': 'string'}
+                }
+            }
+        },
+        400: {
+            'description': 'Ошибка валидации данных или фильтра'
+        }
+    }
+})
+def update_employees_bulk():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Body must be a JSON object"}), 400
+
+    criteria, error_response = build_bulk_criteria(data)
+    if error_response:
+        return jsonify(error_response), 400
+
+    changes = data.get('set')
+    if not isinstance(changes, dict):
+        return jsonify({"error": "'set' must be an object"}), 400
+    valid, error_response = validate_employee_update_data(changes)
+    if not valid:
+        return jsonify(error_response), 400
+    values = {f: changes[f] for f in ['name', 'surname', 'position', 'city'] if f in changes}
+    if not values:
+        return jsonify({"error": "No fields to update"}), 400
+
+    result = db.session.execute(
+        db.update(Employee).where(*criteria).values(**with_folded_name(values), updated_at=datetime.datetime.utcnow()),
+        execution_options={'synchronize_session': False}
+    )
+    if result.rowcount:
+        bump_change_counter('employee')
+    db.session.commit()
+    if result.rowcount:
+        employee_cache.clear()
+
+    return jsonify({
+        "updated": result.rowcount,
+        "message": "Employees updated successfully"
+    })
+
+
+@app.route('/employees', methods=['DELETE'])
+@require_auth
+@require_permission('employees:write')
+@swag_from({
+    'tags': ['Employees'],
+    'description': 'Массовое удаление одним DELETE ... WHERE по списку id и/или фильтру',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'ids': {'type': 'array', 'items': {'type': 'integer'}},
+                    'filter': {'type': 'object'}
+                }
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Количество удалённых сотрудников',
             'schema': {
                 'type': 'object',
                 'properties': {
-                    'error': {'type': 'string'},
-                    'missing_fields': {
-                        'type': 'array',
-                        'items': {'type': 'string'}
-                    }
+                    'deleted': {'type': 'integer'},
+                    'message': {'type': 'string'}
                 }
             }
+        },
+        400: {
+            'description': 'Ошибка в списке id или фильтре'
         }
     }
 })
-def create_employee():
-    data = request.get_json()
-
-    required_fields = ['name', 'surname', 'position']
-    missing = [field for field in required_fields if not data.get(field)]
+def delete_employees_bulk():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Body must be a JSON object"}), 400
 
-    if missing:
-        return jsonify({
-            "error": "Missing required fields",
-            "missing_fields": missing
-        }), 400
-
-    valid, error_response = validate_employee_data(data)
-    if not valid:
+    criteria, error_response = build_bulk_criteria(data)
+    if error_response:
         return jsonify(error_response), 400
-    
-    new_employee = Employee(
-        name=data['name'],
-        surname=data['surname'],
-        position=data['position'],
-        city=data.get('city')
-    )
 
-    db.session.add(new_employee)
+    result = db.session.execute(
+        db.delete(Employee).where(*criteria),
+        execution_options={'synchronize_session': False}
+    )
+    if result.rowcount:
+        bump_change_counter('employee')
     db.session.commit()
+    if result.rowcount:
+        employee_cache.clear()
 
     return jsonify({
-        "id": new_employee.id,
-        "message": "Employee created successfully"
-    }), 201
+        "deleted": result.rowcount,
+        "message": "Employees deleted successfully"
+    })
 
 @app.route('/employee/<int:employee_id>', methods=['DELETE'])
 @swag_from({
@@ -268,18 +2082,259 @@ def create_employee():
     }
 })
 def delete_employee(employee_id):
-    employee = Employee.query.get_or_404(employee_id)
-    db.session.delete(employee)
+    deleted = db.session.execute(
+        db.delete(Employee).where(Employee.id == employee_id).returning(Employee.id),
+        execution_options={'synchronize_session': False}
+    ).first()
+    if deleted is None:
+        db.session.rollback()
+        abort(404)
+    bump_change_counter('employee')
     db.session.commit()
+    employee_cache.invalidate(employee_id)
     return jsonify({'message': 'Deleted'}), 200
 
 
+# --- Пагинация (keyset) и фильтры ---
+DEFAULT_PAGE_LIMIT = 50
+MAX_PAGE_LIMIT = 1000
+
+# Фильтры по равенству и поля сортировки — только колонки с индексами (см. Employee.__table_args__)
+EMPLOYEE_FILTER_FIELDS = ['city', 'position', 'surname', 'name']
+EMPLOYEE_SORT_FIELDS = ['id', 'name', 'surname', 'position', 'city']
+EMPLOYEE_FILTER_PARAMS = set(EMPLOYEE_FILTER_FIELDS) | {'name_prefix'}
+EMPLOYEE_LIST_PARAMS = EMPLOYEE_FILTER_PARAMS | {'sort', 'limit', 'cursor', 'stream'}
+
+
+def employee_to_dict(e):
+    return {
+        'id': e.id,
+        'name': e.name,
+        'surname': e.surname,
+        'position': e.position,
+        'city': e.city
+    }
+
+
+def encode_cursor(sort, key):
+    raw = json.dumps({"s": sort, "k": key}, separators=(',', ':'), ensure_ascii=False).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, sort):
+    # Курсор непрозрачен для клиента: base64url от JSON с сортировкой и ключом последней строки
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded))
+        cursor_sort, key = data["s"], data["k"]
+    except (ValueError, KeyError, TypeError):
+        return None
+    # Курсор от другой сортировки не имеет смысла
+    if cursor_sort != sort or not isinstance(key, list):
+        return None
+    # Ключ — (значение поля сортировки, id) или только id; все поля, кроме id, текстовые
+    field, _ = parse_sort(sort)
+    expected = [int] if field == 'id' else [str, int]
+    if len(key) != len(expected) or not all(cursor_value_valid(v, t) for v, t in zip(key, expected)):
+        return None
+    return key
+
+
+def cursor_value_valid(value, expected_type):
+    if expected_type is int:
+        return isinstance(value, int) and not isinstance(value, bool)
+    if not isinstance(value, str):
+        return False
+    try:
+        value.encode()  # одиночный суррогат из JSON драйвер БД не закодирует
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def parse_page_limit(value):
+    if value is None:
+        return DEFAULT_PAGE_LIMIT
+    try:
+        limit = int(value)
+    except ValueError:
+        return None
+    if limit < 1 or limit > MAX_PAGE_LIMIT:
+        return None
+    return limit
+
+
+def parse_sort(value):
+    # "city" — по возрастанию, "-city" — по убыванию; id всегда добавляется как tie-breaker
+    if value is None:
+        return 'id', False
+    descending = value.startswith('-')
+    field = value.lstrip('-')
+    if field not in EMPLOYEE_SORT_FIELDS:
+        return None, None
+    return field, descending
+
+
+def build_employee_filters(args, allowed_params=EMPLOYEE_LIST_PARAMS):
+    unsupported = [p for p in args if p not in allowed_params]
+    if unsupported:
+        return None, {
+            "error": "Unsupported query parameters",
+            "unsupported_params": unsupported,
+            "supported_params": sorted(allowed_params)
+        }
+
+    wrong_types = [p for p in EMPLOYEE_FILTER_PARAMS if p in args and not isinstance(args[p], str)]
+    if wrong_types:
+        return None, {"error": "Filter values must be strings", "wrong_type_params": wrong_types}
+
+    empty = [p for p in EMPLOYEE_FILTER_FIELDS + ['name_prefix'] if p in args and not args[p]]
+    if empty:
+        return None, {"error": "Filter values cannot be empty", "empty_params": empty}
+
+    criteria = [getattr(Employee, f) == args[f] for f in EMPLOYEE_FILTER_FIELDS if f in args]
+
+    prefix = args.get('name_prefix')
+    if prefix:
+        # Диапазон вместо LIKE — использует индекс ix_employee_name_folded (колонка побайтовая, см. модель)
+        low = fold_name(prefix)
+        next_char = ord(low[-1]) + 1
+        if 0xD800 <= next_char <= 0xDFFF:
+            next_char = 0xE000  # суррогаты не кодируются в UTF-8 — следующий символ после них
+        if next_char > 0x10FFFF or any(0xD800 <= ord(c) <= 0xDFFF for c in low):
+            return None, {"error": "Invalid name_prefix"}
+        high = low[:-1] + chr(next_char)
+        criteria += [Employee.name_folded >= low, Employee.name_folded < high]
+
+    return criteria, None
+
+
+def parse_page_params():
+    # limit/sort/cursor проверяются до условного запроса: иначе при совпавшем ETag ошибка станет 304
+    limit = parse_page_limit(request.args.get('limit'))
+    if limit is None:
+        return None, {"error": f"limit must be an integer between 1 and {MAX_PAGE_LIMIT}"}
+
+    sort = request.args.get('sort', 'id')
+    field, descending = parse_sort(sort)
+    if field is None:
+        return None, {
+            "error": "Unsupported sort field",
+            "supported_sort_fields": EMPLOYEE_SORT_FIELDS
+        }
+
+    key = None
+    cursor = request.args.get('cursor')
+    if cursor:
+        key = decode_cursor(cursor, sort)
+        if key is None:
+            return None, {"error": "Invalid cursor"}
+    return {"limit": limit, "sort": sort, "field": field, "descending": descending, "key": key}, None
+
+
+def get_employees_page(criteria, page):
+    limit, sort, field, descending, key = (page[k] for k in ("limit", "sort", "field", "descending", "key"))
+    columns = [Employee.id] if field == 'id' else [getattr(Employee, field), Employee.id]
+    order = [c.desc() for c in columns] if descending else columns
+    query = Employee.query.filter(*criteria).order_by(*order)
+
+    if key is not None:
+        position = db.tuple_(*columns)
+        query = query.filter(position < db.tuple_(*key) if descending else position > db.tuple_(*key))
+
+    # Берём на одну строку больше, чтобы узнать, есть ли следующая страница
+    employees = query.limit(limit + 1).all()
+    has_next = len(employees) > limit
+    employees = employees[:limit]
+    next_cursor = None
+    if has_next:
+        last = employees[-1]
+        next_cursor = encode_cursor(sort, [getattr(last, c.key) for c in columns])
+
+    response = jsonify({
+        'items': [employee_to_dict(e) for e in employees],
+        'next_cursor': next_cursor
+    })
+    if next_cursor:
+        params = dict(request.args.items(), limit=limit, cursor=next_cursor)
+        next_url = url_for('get_all_employees', **params, _external=True)
+        response.headers['Link'] = f'<{next_url}>; rel="next"'
+    return response
+
+
+# --- Потоковая выдача ---
+STREAM_BATCH_SIZE = 1000
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def iter_employees(criteria):
+    # yield_per включает серверный курсор (stream_results) — строки не копятся в памяти.
+    # Выбираем колонки, а не сущности, чтобы не наполнять identity map
+    stmt = (
+        db.select(Employee.id, Employee.name, Employee.surname, Employee.position, Employee.city)
+        .where(*criteria)
+        .order_by(Employee.id)
+        .execution_options(yield_per=STREAM_BATCH_SIZE)
+    )
+    for row in db.session.execute(stmt):
+        yield row._asdict()
+
+
+def wants_stream():
+    stream = request.args.get('stream')
+    if stream in ('1', 'true', 'json', 'ndjson'):
+        return True
+    return request.accept_mimetypes.best == NDJSON_MIMETYPE
+
+
+def stream_employees(criteria):
+    ndjson = request.args.get('stream') == 'ndjson' or request.accept_mimetypes.best == NDJSON_MIMETYPE
+
+    def generate_ndjson():
+        for item in iter_employees(criteria):
+            yield json.dumps(item, ensure_ascii=False) + '\n'
+
+    def generate_json_array():
+        # Тот же формат, что и у обычного ответа, но отдаётся по частям
+        yield '['
+        first = True
+        for item in iter_employees(criteria):
+            yield ('' if first else ',') + json.dumps(item, ensure_ascii=False)
+            first = False
+        yield ']'
+
+    if ndjson:
+        return Response(stream_with_context(generate_ndjson()), mimetype=NDJSON_MIMETYPE)
+    return Response(stream_with_context(generate_json_array()), mimetype='application/json')
+
+
 @app.route('/employees', methods=['GET'])
 @swag_from({
     'tags': ['Employees'],
+    'description': 'Список сотрудников. С параметрами limit/cursor, фильтрами или sort возвращает страницу '
+                   '(keyset-пагинация) и ссылку на следующую в заголовке Link',
+    'parameters': [
+        {'name': 'city', 'in': 'query', 'type': 'string', 'required': False},
+        {'name': 'position', 'in': 'query', 'type': 'string', 'required': False},
+        {'name': 'surname', 'in': 'query', 'type': 'string', 'required': False},
+        {'name': 'name', 'in': 'query', 'type': 'string', 'required': False},
+        {'name': 'name_prefix', 'in': 'query', 'type': 'string', 'required': False,
+         'description': 'Начало имени, без учёта регистра'},
+        {'name': 'sort', 'in': 'query', 'type': 'string', 'required': False,
+         'enum': EMPLOYEE_SORT_FIELDS + ['-' + f for f in EMPLOYEE_SORT_FIELDS],
+         'description': 'Поле сортировки, "-" — по убыванию'},
+        {'name': 'limit', 'in': 'query', 'type': 'integer', 'required': False,
+         'description': f'Размер страницы (1..{MAX_PAGE_LIMIT}, по умолчанию {DEFAULT_PAGE_LIMIT})'},
+        {'name': 'cursor', 'in': 'query', 'type': 'string', 'required': False,
+         'description': 'Курсор next_cursor из предыдущего ответа'},
+        {'name': 'stream', 'in': 'query', 'type': 'string', 'required': False,
+         'description': 'Потоковая выдача всей таблицы: 1/json — JSON-массив, ndjson — по строке на сотрудника '
+                        '(также включается заголовком Accept: application/x-ndjson). Отдаётся по id; '
+                        'с limit, sort и cursor не сочетается'}
+    ],
     'responses': {
         200: {
-            'description': 'List of all employees',
+            'description': 'List of all employees (или {items, next_cursor} при пагинации)',
             'schema': {
                 'type': 'array',
                 'items': {
@@ -293,18 +2348,46 @@ def delete_employee(employee_id):
                     }
                 }
             }
+        },
+        400: {
+            'description': 'Неподдерживаемый фильтр, сортировка, limit или курсор'
         }
     }
 })
 def get_all_employees():
-    employees = Employee.query.all()
-    return jsonify([{
-        'id': e.id,
-        'name': e.name,
-        'surname': e.surname,
-        'position': e.position,
-        'city': e.city
-    } for e in employees]), 200
+    criteria, error_response = build_employee_filters(request.args)
+    if error_response:
+        return jsonify(error_response), 400
+    stream = wants_stream()
+    page = None
+    if stream:
+        # Поток отдаёт всю выборку по id — параметры страницы молча игнорировать нельзя
+        paging = sorted(set(request.args) & {'limit', 'sort', 'cursor'})
+        if paging:
+            return jsonify({
+                "error": "Pagination parameters cannot be combined with streaming",
+                "unsupported_params": paging
+            }), 400
+    elif set(request.args) - {'stream'}:
+        page, error_response = parse_page_params()
+        if error_response:
+            return jsonify(error_response), 400
+
+    version, last_modified = employee_table_version()
+    etag = f"employees-{version}"
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+
+    if stream:
+        response = stream_employees(criteria)
+    elif page:
+        response = get_employees_page(criteria, page)
+    else:
+        employees = Employee.query.all()
+        response = jsonify([employee_to_dict(e) for e in employees])
+    response.vary.add('Accept')
+    return with_validators(response, etag, last_modified), 200
 
 
 @app.route('/employee/name/<string:name>', methods=['GET'])
@@ -346,17 +2429,18 @@ def get_all_employees():
     }
 })
 def get_employee_by_name(name):
+    # Результат поиска зависит от всей таблицы, поэтому валидатор — счётчик изменений таблицы
+    version, last_modified = employee_table_version()
+    etag = f"employees-{version}"
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+
     employee = Employee.query.filter_by(name=name).first()
     if not employee:
         return jsonify({"error": f"Employee with name '{name}' not found"}), 404
 
-    return jsonify({
-        "id": employee.id,
-        "name": employee.name,
-        "surname": employee.surname,
-        "position": employee.position,
-        "city": employee.city
-    })
+    return with_validators(jsonify(employee_to_dict(employee)), etag, last_modified)
 
 
 @app.route('/employee/<int:id>', methods=['GET'])
@@ -398,17 +2482,48 @@ def get_employee_by_name(name):
     }
 })
 def get_employee(id):
-    employee = Employee.query.get(id)
-    if not employee:
-        return jsonify({"error": f"Employee with id '{id}' not found"}), 404
+    entry = employee_cache.get(id)
+    if entry is None:
+        employee = Employee.query.get(id)
+        if not employee:
+            return jsonify({"error": f"Employee with id '{id}' not found"}), 404
+        entry = {
+            "data": employee_to_dict(employee),
+            "etag": employee_etag(employee),
+            "last_modified": employee.updated_at
+        }
+        employee_cache.set(id, entry)
+
+    cached = not_modified(entry["etag"], entry["last_modified"])
+    if cached:
+        return cached
+    return with_validators(jsonify(entry["data"]), entry["etag"], entry["last_modified"])
 
-    return jsonify({
-        "id": employee.id,
-        "name": employee.name,
-        "surname": employee.surname,
-        "position": employee.position,
-        "city": employee.city
-    })
+
+@app.route('/cache/stats', methods=['GET'])
+@swag_from({
+    'tags': ['Cache'],
+    'description': 'Счётчики кэша сотрудников текущего воркера',
+    'responses': {
+        200: {
+            'description': 'Статистика кэша',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'size': {'type': 'integer'},
+                    'maxsize': {'type': 'integer'},
+                    'ttl': {'type': 'number'},
+                    'hits': {'type': 'integer'},
+                    'misses': {'type': 'integer'},
+                    'evictions': {'type': 'integer'},
+                    'generation': {'type': 'integer'}
+                }
+            }
+        }
+    }
+})
+def cache_stats():
+    return jsonify(employee_cache.stats())
 
 
 
@@ -437,6 +2552,7 @@ def validate_employee_update_data(data):
 
 @app.route('/employee/<int:id>', methods=['PUT'])
 @require_auth
+@require_permission('employees:write')
 @swag_from({
     'tags': ['Employee'],
     'description': 'Обновить информацию о сотруднике (частично или полностью)',
@@ -497,25 +2613,45 @@ def validate_employee_update_data(data):
     }
 })
 def update_employee(id):
-    employee = Employee.query.get(id)
-    if not employee:
-        return jsonify({"error": f"Employee with id '{id}' not found"}), 404
+    # silent: нечитаемое тело и не-объект попадают в редкий путь ниже, где 404 проверяется раньше
+    data = request.get_json(silent=True)
+    valid, values = False, {}
+    if isinstance(data, dict):
+        valid, error_response = validate_employee_update_data(data)
+        # Обновляем только переданные поля
+        values = {f: data[f] for f in ['name', 'surname', 'position', 'city'] if f in data}
 
-    data = request.get_json() or {}
-
-    valid, error_response = validate_employee_update_data(data)
-    if not valid:
-        return jsonify(error_response), 400
+    if not valid or not values:
+        # Редкий путь: для ошибок и пустых обновлений сохраняем прежний порядок ответов
+        # (404, затем 415/400 на нечитаемое тело, затем 400 валидации)
+        exists = db.session.execute(db.select(Employee.id).where(Employee.id == id)).first()
+        if not exists:
+            return jsonify({"error": f"Employee with id '{id}' not found"}), 404
+        data = request.get_json() or {}
+        if not isinstance(data, dict):
+            return jsonify({"error": "Body must be a JSON object"}), 400
+        valid, error_response = validate_employee_update_data(data)
+        if not valid:
+            return jsonify(error_response), 400
+        return jsonify({
+            "id": id,
+            "message": "Employee updated successfully"
+        })
 
-    # Обновляем только переданные поля
-    for field in ['name', 'surname', 'position', 'city']:
-        if field in data:
-            setattr(employee, field, data[field])
+    updated = db.session.execute(
+        db.update(Employee).where(Employee.id == id).values(**with_folded_name(values)).returning(Employee.id),
+        execution_options={'synchronize_session': False}
+    ).first()
+    if updated is None:
+        db.session.rollback()
+        return jsonify({"error": f"Employee with id '{id}' not found"}), 404
 
+    bump_change_counter('employee')
     db.session.commit()
+    employee_cache.invalidate(id)
 
     return jsonify({
-        "id": employee.id,
+        "id": updated.id,
         "message": "Employee updated successfully"
     })
     
@@ -544,5 +2680,707 @@ def validate_employee_data(data):
     return True, None
 
 
+# --- Метрики Prometheus ---
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "1"))
+
+
+class RequestMetrics:
+    """Счётчики запросов воркера.
+
+    Запись — несколько операций со словарями без блокировок (у sync-воркеров gunicorn
+    один поток). Раз в METRICS_FLUSH_INTERVAL секунд снимок пишется в файл воркера,
+    /metrics суммирует файлы всех воркеров.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.path = None
+        self.requests = {}    # (endpoint, method, status) -> count
+        self.durations = {}   # (endpoint, method) -> [bucket counts..., +Inf count, sum]
+        self.sizes = {}       # (endpoint, method) -> bytes
+        self.in_flight = {}   # (endpoint, method) -> запросов в обработке
+        self._flushed_at = 0
+
+    def start(self):
+        # Маршрут уже сопоставлен: before_request идёт после routing
+        current = request._get_current_object()
+        key = (current.url_rule.rule if current.url_rule else 'unmatched', current.method)
+        self.in_flight[key] = self.in_flight.get(key, 0) + 1
+        g.metrics_in_flight_key = key
+        g.metrics_started = time.perf_counter()
+
+    def finish(self):
+        # teardown вызывается и когда start не успел отработать (ответ из более раннего before_request)
+        key = g.pop('metrics_in_flight_key', None)
+        if key is not None:
+            self.in_flight[key] -= 1
+
+    def record(self, response):
+        started = g.get('metrics_started')
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        # Прокси request обходится дороже локальной переменной — читаем по разу
+        current = request._get_current_object()
+        endpoint = current.url_rule.rule if current.url_rule else 'unmatched'
+        key = (endpoint, current.method)
+
+        status_key = (endpoint, current.method, response.status_code)
+        self.requests[status_key] = self.requests.get(status_key, 0) + 1
+        histogram = self.durations.get(key)
+        if histogram is None:
+            histogram = self.durations[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+        histogram[bisect.bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+        histogram[-1] += elapsed
+        # У потоковых ответов размер заранее неизвестен
+        size = response.content_length
+        if size is not None:
+            self.sizes[key] = self.sizes.get(key, 0) + size
+
+        if time.monotonic() - self._flushed_at >= METRICS_FLUSH_INTERVAL:
+            # Текущий запрос уже отвечен, но teardown ещё впереди — в снимок его не включаем
+            self.flush(finishing=g.get('metrics_in_flight_key'))
+
+    def snapshot(self, finishing=None):
+        in_flight = dict(self.in_flight)
+        if finishing in in_flight:
+            in_flight[finishing] -= 1
+        return {
+            "pid": os.getpid(),
+            "in_flight": [[*k, v] for k, v in in_flight.items() if v],
+            # list() копирует словарь разом: другие потоки воркера могут добавлять ключи
+            "requests": [[*k, v] for k, v in list(self.requests.items())],
+            "durations": [[*k, v] for k, v in list(self.durations.items())],
+            "sizes": [[*k, v] for k, v in list(self.sizes.items())],
+            "counters": collect_counters(),
+            "slow_queries": slow_query_log.snapshot()
+        }
+
+    def flush(self, finishing=None):
+        self._flushed_at = time.monotonic()
+        if self.path is None:
+            # pid может повториться после перезапуска воркера — добавляем время старта
+            self.path = os.path.join(self.directory, f'worker_{os.getpid()}_{int(time.time() * 1000)}.json')
+        # Временный файл на поток: при --threads несколько потоков сбрасывают снимок одновременно
+        tmp_path = f'{self.path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(finishing), f)
+        os.replace(tmp_path, self.path)
+
+    def collect(self):
+        """Снимки всех воркеров; для текущего — свежее состояние из памяти."""
+        self.flush()
+        self.fold_dead_workers()
+        snapshots = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            # Воркер умер после сворачивания (или flock недоступен): его запросы уже не в обработке
+            if snapshot["pid"] and not pid_alive(snapshot["pid"]):
+                snapshot["in_flight"] = []
+            snapshots.append(snapshot)
+        return snapshots
+
+    def dead_worker_files(self):
+        dead = []
+        for name in os.listdir(self.directory):
+            match = re.fullmatch(r'worker_(\d+)_\d+\.json', name)
+            if match and not pid_alive(int(match.group(1))):
+                dead.append(os.path.join(self.directory, name))
+        return dead
+
+    def fold_dead_workers(self):
+        """Сворачивает снимки умерших воркеров в один файл.
+
+        Их счётчики продолжают входить в суммы (иначе counter уменьшится), а файлы
+        не копятся с каждым перезапуском воркера и деплоем.
+        """
+        if not self.dead_worker_files():
+            return
+        try:
+            import fcntl  # flock есть только на Unix — без него снимки просто не сворачиваются
+        except ImportError:
+            return
+        aggregate_path = os.path.join(self.directory, DEAD_WORKERS_FILE)
+        with open(os.path.join(self.directory, '.fold.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # Под блокировкой список заново: другой воркер мог уже свернуть часть файлов
+            dead = self.dead_worker_files()
+            if not dead:
+                return
+            try:
+                with open(aggregate_path) as f:
+                    aggregate = json.load(f)
+            except (OSError, ValueError):
+                aggregate = empty_snapshot()
+            for path in dead:
+                try:
+                    with open(path) as f:
+                        merge_snapshot(aggregate, json.load(f))
+                except (OSError, ValueError):
+                    pass
+            tmp_path = aggregate_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(aggregate, f)
+            os.replace(tmp_path, aggregate_path)
+            for path in dead:
+                os.remove(path)
+
+
+DEAD_WORKERS_FILE = 'dead_workers.json'
+
+
+def empty_snapshot():
+    return {"pid": None, "in_flight": [], "requests": [], "durations": [], "sizes": [],
+            "counters": [], "slow_queries": {}}
+
+
+def merge_rows(into, rows, width):
+    # Строки [*ключ из width полей, значение]; значение — число или гистограмма (список)
+    merged = {tuple(row[:width]): row[width] for row in into}
+    for row in rows:
+        key, value = tuple(row[:width]), row[width]
+        previous = merged.get(key)
+        if previous is None:
+            merged[key] = value
+        elif isinstance(value, list):
+            merged[key] = [a + b for a, b in zip(previous, value)]
+        else:
+            merged[key] = previous + value
+    return [[*key, value] for key, value in merged.items()]
+
+
+def merge_snapshot(total, snapshot):
+    """Прибавляет счётчики снимка к total; in_flight умершего воркера не переносится."""
+    total["requests"] = merge_rows(total["requests"], snapshot["requests"], 3)
+    total["durations"] = merge_rows(total["durations"], snapshot["durations"], 2)
+    total["sizes"] = merge_rows(total["sizes"], snapshot["sizes"], 2)
+    # Метки — словарь, в ключ идут отсортированными парами
+    counters = [[name, json.dumps(labels, sort_keys=True), value] for name, labels, value in total["counters"]]
+    if isinstance(snapshot.get("counters"), list):
+        counters = merge_rows(counters, [[name, json.dumps(labels, sort_keys=True), value]
+                                         for name, labels, value in snapshot["counters"]], 2)
+    total["counters"] = [[name, json.loads(labels), value] for name, labels, value in counters]
+    for fingerprint, entry in snapshot.get("slow_queries", {}).items():
+        merged = total["slow_queries"].setdefault(
+            fingerprint, {"count": 0, "total": 0.0, "max": 0.0, "samples": [], "plan": None})
+        merged["count"] += entry["count"]
+        merged["total"] += entry["total"]
+        merged["max"] = max(merged["max"], entry["max"])
+        merged["samples"] = (merged["samples"] + entry["samples"])[-SLOW_QUERY_SAMPLES:]
+        merged["plan"] = merged["plan"] or entry["plan"]
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+COUNTER_HELP = {
+    "employee_cache_hits_total": "Employee cache hits.",
+    "employee_cache_misses_total": "Employee cache misses.",
+    "employee_cache_evictions_total": "Employee cache evictions.",
+    "login_limiter_allowed_total": "Login attempts allowed by the rate limiter, by bucket scope.",
+    "login_limiter_rejected_total": "Login attempts rejected by the rate limiter, by bucket scope.",
+}
+
+
+def collect_counters():
+    # [семейство, метки, значение]: метки отдельно, чтобы HELP/TYPE печатались по разу на семейство
+    counters = [
+        ["employee_cache_hits_total", {}, employee_cache.hits],
+        ["employee_cache_misses_total", {}, employee_cache.misses],
+        ["employee_cache_evictions_total", {}, employee_cache.evictions],
+    ]
+    for scope, limiter in login_limiters.items():
+        counters.append(["login_limiter_allowed_total", {"scope": scope}, limiter.allowed])
+        counters.append(["login_limiter_rejected_total", {"scope": scope}, limiter.rejected])
+    return counters
+
+
+def prometheus_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_metrics(snapshots):
+    requests_total, durations, sizes, counters, in_flight = {}, {}, {}, {}, {}
+    for snapshot in snapshots:
+        # Снимки прежних версий хранили in_flight одним числом — пропускаем
+        for endpoint, method, count in snapshot["in_flight"] if isinstance(snapshot["in_flight"], list) else []:
+            in_flight[(endpoint, method)] = in_flight.get((endpoint, method), 0) + count
+        for endpoint, method, status, count in snapshot["requests"]:
+            key = (endpoint, method, status)
+            requests_total[key] = requests_total.get(key, 0) + count
+        for endpoint, method, histogram in snapshot["durations"]:
+            total = durations.setdefault((endpoint, method), [0] * len(histogram))
+            for i, value in enumerate(histogram):
+                total[i] += value
+        for endpoint, method, size in snapshot["sizes"]:
+            sizes[(endpoint, method)] = sizes.get((endpoint, method), 0) + size
+        # Снимки прежних версий хранили счётчики словарём с метками в имени — пропускаем
+        for name, labels, value in snapshot["counters"] if isinstance(snapshot["counters"], list) else []:
+            samples = counters.setdefault(name, {})
+            key = tuple(sorted(labels.items()))
+            samples[key] = samples.get(key, 0) + value
+
+    lines = [
+        '# HELP http_requests_total Total HTTP requests by endpoint, method and status.',
+        '# TYPE http_requests_total counter',
+    ]
+    for (endpoint, method, status), count in sorted(requests_total.items()):
+        lines.append(f'http_requests_total{{endpoint="{prometheus_label(endpoint)}",method="{method}",'
+                     f'status="{status}"}} {count}')
+
+    lines += [
+        '# HELP http_request_duration_seconds HTTP request latency by endpoint and method.',
+        '# TYPE http_request_duration_seconds histogram',
+    ]
+    for (endpoint, method), histogram in sorted(durations.items()):
+        labels = f'endpoint="{prometheus_label(endpoint)}",method="{method}"'
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), histogram[:-1]):
+            cumulative += count
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'http_request_duration_seconds_sum{{{labels}}} {histogram[-1]:.6f}')
+        lines.append(f'http_request_duration_seconds_count{{{labels}}} {cumulative}')
+
+    lines += [
+        '# HELP http_response_size_bytes_total Bytes sent in response bodies (streaming responses excluded).',
+        '# TYPE http_response_size_bytes_total counter',
+    ]
+    for (endpoint, method), size in sorted(sizes.items()):
+        lines.append(f'http_response_size_bytes_total{{endpoint="{prometheus_label(endpoint)}",'
+                     f'method="{method}"}} {size}')
+
+    lines += [
+        '# HELP http_requests_in_flight Requests currently being handled by live workers.',
+        '# TYPE http_requests_in_flight gauge',
+    ]
+    for (endpoint, method), count in sorted(in_flight.items()):
+        lines.append(f'http_requests_in_flight{{endpoint="{prometheus_label(endpoint)}",'
+                     f'method="{method}"}} {count}')
+    for name, samples in sorted(counters.items()):
+        lines.append(f'# HELP {name} {COUNTER_HELP.get(name, name)}')
+        lines.append(f'# TYPE {name} counter')
+        for labels, value in sorted(samples.items()):
+            rendered = ','.join(f'{key}="{prometheus_label(label)}"' for key, label in labels)
+            lines.append(f'{name}{{{rendered}}} {value}' if rendered else f'{name} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+request_metrics = RequestMetrics(
+    os.getenv("METRICS_DIR") or os.path.join(tempfile.gettempdir(), f'metrics_{database_key()}')
+)
+
+
+@app.before_request
+def start_request_metrics():
+    request_metrics.start()
+
+
+@app.after_request
+def record_request_metrics(response):
+    request_metrics.record(response)
+    return response
+
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    request_metrics.finish()
+
+
+@app.route('/metrics', methods=['GET'])
+@swag_from({
+    'tags': ['Monitoring'],
+    'description': 'Метрики в текстовом формате Prometheus, суммированные по всем воркерам хоста',
+    'responses': {
+        200: {'description': 'text/plain; version=0.0.4'}
+    }
+})
+def metrics():
+    return Response(render_metrics(request_metrics.collect()), mimetype='text/plain; version=0.0.4')
+
+
+# --- Журнал медленных запросов ---
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+SLOW_QUERY_EXPLAIN_RATE = float(os.getenv("SLOW_QUERY_EXPLAIN_RATE", "0"))
+SLOW_QUERY_MAX_FINGERPRINTS = 100
+SLOW_QUERY_SAMPLES = 100
+
+FINGERPRINT_RULES = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),                     # строковые литералы
+    (re.compile(r'%\(\w+\)s|%s|\$\d+|(?<!:):\w+\b'), '?'),  # bind-параметры разных драйверов; ::type не трогаем
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),                    # числа
+    (re.compile(r'\bIN\s*\((?:\s*\?\s*,?)+\)', re.I), 'IN (...)'),
+    (re.compile(r'\bVALUES\s*\([^)]*\)(?:\s*,\s*\([^)]*\))*', re.I), 'VALUES (...)'),
+    (re.compile(r'\s+'), ' '),
+]
+
+
+def fingerprint_statement(statement):
+    # Нормализованный текст без значений: по нему агрегируются запросы одной формы
+    for pattern, replacement in FINGERPRINT_RULES:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+class SlowQueryLog:
+    """Медленные запросы воркера: агрегаты по отпечаткам и ротируемый файл журнала."""
+
+    def __init__(self, threshold_ms, directory):
+        self.threshold = threshold_ms / 1000
+        self.directory = directory
+        self.stats = {}  # отпечаток -> {count, total, max, samples, plan}
+        self._logger = None
+        self._lock = threading.Lock()
+
+    def _get_logger(self):
+        # Файл на воркер: RotatingFileHandler не умеет ротировать файл, в который пишут несколько процессов
+        if self._logger is None:
+            os.makedirs(self.directory, exist_ok=True)
+            logger = logging.getLogger(f'slow_queries.{os.getpid()}')
+            logger.propagate = False
+            logger.setLevel(logging.INFO)
+            handler = logging.handlers.RotatingFileHandler(
+                os.path.join(self.directory, f'slow_queries_{os.getpid()}.log'),
+                maxBytes=10 * 1024 * 1024, backupCount=3
+            )
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger.addHandler(handler)
+            self._logger = logger
+        return self._logger
+
+    def observe(self, statement, elapsed, cursor, parameters, executemany):
+        if elapsed < self.threshold:
+            return
+        fingerprint = fingerprint_statement(statement)
+        with self._lock:
+            entry = self.stats.get(fingerprint)
+            if entry is None:
+                if len(self.stats) >= SLOW_QUERY_MAX_FINGERPRINTS:
+                    return
+                entry = self.stats[fingerprint] = {
+                    "count": 0, "total": 0.0, "max": 0.0,
+                    "samples": deque(maxlen=SLOW_QUERY_SAMPLES), "plan": None
+                }
+            worst = elapsed > entry["max"]
+            entry["count"] += 1
+            entry["total"] += elapsed
+            entry["max"] = max(entry["max"], elapsed)
+            entry["samples"].append(elapsed)
+        if worst and not executemany and random.random() < SLOW_QUERY_EXPLAIN_RATE:
+            entry["plan"] = explain_statement(cursor, statement, parameters)
+        self._get_logger().info(json.dumps({
+            "time": datetime.datetime.utcnow().isoformat(),
+            "duration_ms": round(elapsed * 1000, 2),
+            "endpoint": request.url_rule.rule if has_request_context() and request.url_rule else None,
+            "fingerprint": fingerprint
+        }, ensure_ascii=False))
+
+    def snapshot(self):
+        with self._lock:
+            return {fingerprint: {**entry, "samples": list(entry["samples"])} for fingerprint, entry in self.stats.items()}
+
+
+def explain_statement(cursor, statement, parameters):
+    # Через сырой DBAPI-курсор: события SQLAlchemy не срабатывают повторно
+    if not statement.lstrip().upper().startswith('SELECT'):
+        return None
+    prefix = 'EXPLAIN QUERY PLAN ' if db.engine.dialect.name == 'sqlite' else 'EXPLAIN '
+    explain_cursor = cursor.connection.cursor()
+    try:
+        explain_cursor.execute(prefix + statement, parameters)
+        return '\n'.join(' '.join(str(col) for col in row) for row in explain_cursor.fetchall())
+    except Exception as e:
+        return f'EXPLAIN failed: {e}'
+    finally:
+        explain_cursor.close()
+
+
+def percentile(sorted_samples, q):
+    return sorted_samples[min(len(sorted_samples) - 1, int(q * len(sorted_samples)))]
+
+
+def merge_slow_queries(snapshots):
+    merged = {}
+    for snapshot in snapshots:
+        for fingerprint, entry in snapshot.get("slow_queries", {}).items():
+            total = merged.setdefault(fingerprint, {"count": 0, "total": 0.0, "max": 0.0, "samples": [], "plan": None})
+            total["count"] += entry["count"]
+            total["total"] += entry["total"]
+            total["max"] = max(total["max"], entry["max"])
+            total["samples"] += entry["samples"]
+            total["plan"] = total["plan"] or entry["plan"]
+    report = []
+    for fingerprint, entry in merged.items():
+        samples = sorted(entry["samples"])
+        report.append({
+            "fingerprint": fingerprint,
+            "count": entry["count"],
+            "total_ms": round(entry["total"] * 1000, 2),
+            "p50_ms": round(percentile(samples, 0.5) * 1000, 2),
+            "p99_ms": round(percentile(samples, 0.99) * 1000, 2),
+            "max_ms": round(entry["max"] * 1000, 2),
+            "plan": entry["plan"]
+        })
+    return sorted(report, key=lambda r: r["total_ms"], reverse=True)
+
+
+slow_query_log = SlowQueryLog(
+    SLOW_QUERY_MS,
+    os.getenv("SLOW_QUERY_LOG_DIR") or os.path.join(tempfile.gettempdir(), f'slow_queries_{database_key()}')
+)
+
+
+@app.route('/admin/slow-queries', methods=['GET'])
+@require_auth
+@require_permission('users:admin')
+@swag_from({
+    'tags': ['Monitoring'],
+    'description': f'Медленные запросы (дольше SLOW_QUERY_MS, сейчас {SLOW_QUERY_MS} мс) по всем воркерам хоста, '
+                   'сгруппированные по отпечатку без параметров; p50/p99 — по последним замерам',
+    'parameters': [
+        {'name': 'limit', 'in': 'query', 'type': 'integer', 'required': False, 'default': 20}
+    ],
+    'responses': {
+        200: {'description': 'Список отпечатков, от наибольшего суммарного времени'},
+        403: {'description': 'Нет права users:admin'}
+    }
+})
+def slow_queries():
+    limit = request.args.get('limit', 20, type=int)
+    report = merge_slow_queries(request_metrics.collect())
+    return jsonify({"threshold_ms": SLOW_QUERY_MS, "queries": report[:limit]})
+
+
+# --- Профилирование SQL по запросам ---
+# Server-Timing раскрывает внутренности, поэтому в production (APP_ENV=production) он выключен
+SERVER_TIMING_ENABLED = os.getenv("APP_ENV", "development") != "production"
+SQL_REPEAT_THRESHOLD = int(os.getenv("SQL_REPEAT_THRESHOLD", "10"))
+
+
+@app.before_request
+def start_sql_profile():
+    g.sql_count = 0
+    g.sql_time = 0.0
+    g.sql_shapes = {}
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Время старта — на контексте выполнения, а не в conn.info: при ошибке after_cursor_execute
+    # не вызывается, и запись жила бы столько же, сколько соединение в пуле
+    context._query_started = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._query_started
+    slow_query_log.observe(statement, elapsed, cursor, parameters, executemany)
+    # Вне запроса (CLI, старт приложения) считать некуда
+    if not has_request_context() or 'sql_shapes' not in g:
+        return
+    g.sql_count += 1
+    g.sql_time += elapsed
+    # Параметры передаются отдельно, так что текст запроса и есть его «форма»
+    g.sql_shapes[statement] = g.sql_shapes.get(statement, 0) + 1
+
+
+with app.app_context():
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(db.engine, 'after_cursor_execute', after_cursor_execute)
+
+
+@app.after_request
+def finish_sql_profile(response):
+    if 'sql_shapes' not in g:
+        return response
+    if SERVER_TIMING_ENABLED:
+        response.headers.add('Server-Timing', f'db;dur={g.sql_time * 1000:.2f};desc="{g.sql_count} queries"')
+    for statement, count in g.sql_shapes.items():
+        if count > SQL_REPEAT_THRESHOLD:
+            # Типичный признак N+1: одна и та же форма запроса в цикле
+            app.logger.warning("Possible N+1: %s %s ran the same statement %d times: %s",
+                               request.method, request.path, count, ' '.join(statement.split())[:300])
+    return response
+
+
+# --- Синтетические данные для нагрузочных тестов ---
+# Имена: (мужские, женские); русские фамилии в списке мужские, женская форма — с окончанием «а»
+SEED_FIRST_NAMES = {
+    'ru': (["Александр", "Дмитрий", "Максим", "Сергей", "Андрей", "Алексей", "Иван", "Михаил",
+            "Никита", "Артём", "Евгений", "Владимир", "Павел", "Роман"],
+           ["Анна", "Мария", "Елена", "Ольга", "Наталья", "Татьяна", "Екатерина", "Ирина",
+            "Светлана", "Юлия", "Дарья", "Ксения", "Алина", "Виктория"]),
+    'en': (["James", "John", "Robert", "Michael", "David", "William", "Thomas", "Daniel"],
+           ["Mary", "Patricia", "Jennifer", "Linda", "Elizabeth", "Sarah", "Emma", "Olivia"]),
+}
+SEED_SURNAMES = {
+    'ru': ["Иванов", "Смирнов", "Кузнецов", "Попов", "Васильев", "Петров", "Соколов", "Михайлов",
+           "Новиков", "Фёдоров", "Морозов", "Волков", "Алексеев", "Лебедев", "Семёнов", "Егоров"],
+    'en': ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis",
+           "Wilson", "Taylor", "Anderson", "Moore"],
+}
+# Порядок важен: по рангу распределяются веса Zipf — первые встречаются чаще всего
+SEED_CITIES = ["Москва", "Санкт-Петербург", "Новосибирск", "Екатеринбург", "Казань", "Нижний Новгород",
+               "Челябинск", "Самара", "London", "Berlin", "Омск", "Ростов-на-Дону", "Уфа", "Красноярск",
+               "Воронеж", "Пермь", "Amsterdam", "Волгоград", "Краснодар", "Тюмень", "Prague", "Ижевск"]
+SEED_POSITIONS = ["Developer", "Senior Developer", "QA Engineer", "Менеджер", "Аналитик", "DevOps",
+                  "Team Lead", "Дизайнер", "Бухгалтер", "HR", "Product Manager", "Architect",
+                  "Data Scientist", "Юрист", "CTO"]
+SEED_ZIPF_EXPONENT = 1.0
+TRANSLIT = str.maketrans(dict(zip(
+    'абвгдеёжзийклмнопрстуфхцчшщъыьэюя',
+    ['a', 'b', 'v', 'g', 'd', 'e', 'e', 'zh', 'z', 'i', 'y', 'k', 'l', 'm', 'n', 'o', 'p', 'r',
+     's', 't', 'u', 'f', 'kh', 'ts', 'ch', 'sh', 'shch', '', 'y', '', 'e', 'yu', 'ya']
+)))
+
+
+def zipf_cum_weights(n, exponent=SEED_ZIPF_EXPONENT):
+    return list(accumulate(1 / rank ** exponent for rank in range(1, n + 1)))
+
+
+def random_person(rnd, cyrillic_share):
+    locale = 'ru' if rnd.random() < cyrillic_share else 'en'
+    female = rnd.random() < 0.5
+    name = rnd.choice(SEED_FIRST_NAMES[locale][female])
+    surname = rnd.choice(SEED_SURNAMES[locale])
+    if female and locale == 'ru':
+        surname += 'а'
+    return name, surname
+
+
+EMPLOYEE_SEED_COLUMNS = ['name', 'name_folded', 'surname', 'position', 'city', 'updated_at']
+
+
+def employee_rows(size, rnd, cyrillic_share, now):
+    """Пачка строк Employee в порядке EMPLOYEE_SEED_COLUMNS."""
+    cities = rnd.choices(SEED_CITIES, cum_weights=zipf_cum_weights(len(SEED_CITIES)), k=size)
+    positions = rnd.choices(SEED_POSITIONS, cum_weights=zipf_cum_weights(len(SEED_POSITIONS)), k=size)
+    rows = []
+    for position, city in zip(positions, cities):
+        name, surname = random_person(rnd, cyrillic_share)
+        rows.append((name, fold_name(name), surname, position, city, now))
+    return rows
+
+
+def user_rows(size, rnd, cyrillic_share, first_number, password_hashes):
+    """Пачка строк User: (username, password_hash, role, token_version).
+
+    Username латиницей с порядковым номером — уникален без проверки по базе.
+    """
+    rows = []
+    for number in range(first_number, first_number + size):
+        name, surname = random_person(rnd, cyrillic_share)
+        username = f"{name.lower().translate(TRANSLIT)}.{surname.lower().translate(TRANSLIT)}{number}"
+        role = 'viewer' if rnd.random() < 0.1 else 'user'
+        rows.append((username, password_hashes[number % len(password_hashes)], role, 1))
+    return rows
+
+
+def copy_value(value):
+    # Текстовый формат COPY: \N — NULL, спецсимволы экранируются обратной косой чертой
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def bulk_insert(table, columns, batches):
+    """Загрузка пачками мимо ORM: COPY на Postgres, executemany DBAPI-курсора на остальных.
+
+    Каждая пачка — отдельная транзакция; возвращает число вставленных строк.
+    """
+    dialect = db.engine.dialect
+    quoted = dialect.identifier_preparer.quote(table)
+    column_list = ', '.join(columns)
+    placeholder = '?' if dialect.paramstyle == 'qmark' else '%s'
+    insert_sql = f'INSERT INTO {quoted} ({column_list}) VALUES ({", ".join([placeholder] * len(columns))})'
+    inserted = 0
+    conn = db.engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        for rows in batches:
+            if dialect.name == 'postgresql':
+                buffer = io.StringIO()
+                for row in rows:
+                    buffer.write('\t'.join(copy_value(value) for value in row) + '\n')
+                buffer.seek(0)
+                cursor.copy_expert(f'COPY {quoted} ({column_list}) FROM STDIN', buffer)
+            else:
+                cursor.executemany(insert_sql, rows)
+            conn.commit()
+            inserted += len(rows)
+            print(f"  {table}: {inserted} rows", end='\r', flush=True)
+        print()
+        cursor.close()
+    finally:
+        conn.close()
+    return inserted
+
+
+def batch_sizes(total, batch_size):
+    for start in range(0, total, batch_size):
+        yield min(batch_size, total - start)
+
+
+@app.cli.command('seed-bulk')
+@click.option('--employees', default=0, show_default=True, help='Сколько сотрудников добавить')
+@click.option('--users', default=0, show_default=True, help='Сколько пользователей добавить')
+@click.option('--batch-size', default=50000, show_default=True, help='Строк в одной пачке (транзакции)')
+@click.option('--cyrillic-share', default=0.7, show_default=True, help='Доля кириллических имён')
+@click.option('--password', default='password', show_default=True, help='Пароль всех новых пользователей')
+@click.option('--hash-variants', default=32, show_default=True,
+              help='Сколько хешей пароля (с разной солью) посчитать заранее и раздать по кругу')
+@click.option('--seed', type=int, default=None, help='Seed генератора для воспроизводимых данных')
+def seed_bulk_command(employees, users, batch_size, cyrillic_share, password, hash_variants, seed):
+    """Наполнить Employee и User синтетическими данными для нагрузочных тестов."""
+    rnd = random.Random(seed)
+    dialect = db.engine.dialect
+
+    if employees:
+        started = time.perf_counter()
+        now = datetime.datetime.utcnow()
+        inserted = bulk_insert('employee', EMPLOYEE_SEED_COLUMNS, (
+            employee_rows(size, rnd, cyrillic_share, now) for size in batch_sizes(employees, batch_size)
+        ))
+        bump_change_counter('employee')
+        db.session.execute(db.text('ANALYZE employee'))
+        db.session.commit()
+        employee_cache.clear()
+        elapsed = time.perf_counter() - started
+        print(f"✅ Employees: {inserted} rows in {elapsed:.1f}s ({inserted / elapsed:.0f} rows/s)")
+
+    if users:
+        started = time.perf_counter()
+        # Хеширование — самая дорогая часть: считаем несколько вариантов параллельно вместо хеша на каждого
+        password_hashes = hash_passwords([password] * max(1, min(hash_variants, users)))
+        first_number = (db.session.execute(db.select(db.func.max(User.id))).scalar() or 0) + 1
+        numbers = iter(range(first_number, first_number + users, batch_size))
+        inserted = bulk_insert('user', ['username', 'password_hash', 'role', 'token_version'], (
+            user_rows(size, rnd, cyrillic_share, next(numbers), password_hashes)
+            for size in batch_sizes(users, batch_size)
+        ))
+        db.session.execute(db.text(f'ANALYZE {dialect.identifier_preparer.quote("user")}'))
+        db.session.commit()
+        username_index.generation.bump()
+        elapsed = time.perf_counter() - started
+        print(f"✅ Users: {inserted} rows in {elapsed:.1f}s ({inserted / elapsed:.0f} rows/s), "
+              f"password: {password!r}")
+
+    if not employees and not users:
+        print("ℹ️ Nothing to do: pass --employees and/or --users.")
+
+
 if __name__ == '__main__':
     app.run(debug=True)
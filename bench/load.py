@@ -0,0 +1,297 @@
+"""Нагрузочный бенчмарк маршрутов: Flask test client и настоящий gunicorn.
+
+Наполняет отдельную базу синтетическими сотрудниками, гоняет каждый маршрут
+с заданной конкурентностью и печатает пропускную способность и p50/p95/p99.
+Результаты пишутся в JSON, с --compare сравниваются с прошлым прогоном:
+при регрессии сверх --tolerance скрипт завершается с кодом 1.
+
+Запуск из корня репозитория:
+    python bench/load.py [--employees 10000] [--mode client|gunicorn|both]
+                         [--concurrency 8] [--requests 500] [--workers 2]
+                         [--routes employees_page,employee_get]
+                         [--output results.json] [--compare baseline.json]
+
+База по умолчанию — SQLite-файл во временном каталоге; для Postgres задайте DATABASE_URL.
+"""
+import argparse
+import datetime
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def build_routes(ctx):
+    """Маршруты бенчмарка: имя -> функция, возвращающая (method, path, json_body, нужен ли токен)."""
+    from app import SEED_CITIES, SEED_FIRST_NAMES, SEED_POSITIONS, SEED_SURNAMES
+
+    names = [name for group in SEED_FIRST_NAMES['ru'] + SEED_FIRST_NAMES['en'] for name in group]
+    surnames = SEED_SURNAMES['ru'] + SEED_SURNAMES['en']
+
+    def employee_id(rnd):
+        return rnd.randint(ctx["min_id"], ctx["max_id"])
+
+    return {
+        "employees_page": lambda rnd: ("GET", "/employees?limit=50", None, False),
+        "employees_filter": lambda rnd: ("GET", f"/employees?city={rnd.choice(SEED_CITIES)}&limit=50", None, False),
+        "employee_get": lambda rnd: ("GET", f"/employee/{employee_id(rnd)}", None, False),
+        "employee_by_name": lambda rnd: ("GET", f"/employee/name/{rnd.choice(names)}", None, False),
+        "users_available": lambda rnd: ("GET", f"/users/available?username=bench{rnd.randint(0, 10 ** 6)}", None, False),
+        "employee_update": lambda rnd: ("PUT", f"/employee/{employee_id(rnd)}",
+                                        {"position": rnd.choice(SEED_POSITIONS)}, True),
+        "employee_create": lambda rnd: ("POST", "/employee",
+                                        {"name": rnd.choice(names), "surname": rnd.choice(surnames),
+                                         "position": rnd.choice(SEED_POSITIONS), "city": rnd.choice(SEED_CITIES)}, True),
+        "login": lambda rnd: ("POST", "/login", {"username": "admin", "password": "admin"}, False),
+        "metrics": lambda rnd: ("GET", "/metrics", None, False),
+    }
+
+
+def seed_employees(count):
+    # Те же генератор и загрузка, что у `flask seed-bulk`; досеиваем до count строк
+    from sqlalchemy import func
+    from app import app, db, Employee, EMPLOYEE_SEED_COLUMNS, batch_sizes, bulk_insert, employee_rows
+
+    rnd = random.Random(42)
+    now = datetime.datetime.utcnow()
+    with app.app_context():
+        existing = db.session.query(func.count(Employee.id)).scalar()
+        bulk_insert('employee', EMPLOYEE_SEED_COLUMNS, (
+            employee_rows(size, rnd, 0.7, now) for size in batch_sizes(max(0, count - existing), 10000)
+        ))
+        min_id, max_id = db.session.query(func.min(Employee.id), func.max(Employee.id)).one()
+    return {"min_id": min_id or 1, "max_id": max_id or 1}
+
+
+def percentile(sorted_samples, q):
+    return sorted_samples[min(len(sorted_samples) - 1, int(q * len(sorted_samples)))]
+
+
+def drive(send, make_request, total, concurrency, token):
+    """Отправляет total запросов из concurrency потоков, возвращает сводку по задержкам."""
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    remaining = iter(range(total))
+
+    def worker(seed):
+        rnd = random.Random(seed)
+        local_latencies = []
+        local_statuses = {}
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    break
+            method, path, body, auth = make_request(rnd)
+            headers = {"Authorization": f"Bearer {token}"} if auth else {}
+            started = time.perf_counter()
+            try:
+                status = send(method, path, body, headers)
+            except OSError:
+                status = "error"
+            local_latencies.append(time.perf_counter() - started)
+            local_statuses[status] = local_statuses.get(status, 0) + 1
+        with lock:
+            latencies.extend(local_latencies)
+            for status, count in local_statuses.items():
+                statuses[str(status)] = statuses.get(str(status), 0) + count
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    ok = sum(count for status, count in statuses.items() if status.isdigit() and int(status) < 400)
+    return {
+        "requests": len(latencies),
+        "errors": len(latencies) - ok,
+        "statuses": statuses,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def client_sender():
+    from app import app
+
+    local = threading.local()
+
+    def send(method, path, body, headers):
+        if not hasattr(local, "client"):
+            local.client = app.test_client()
+        response = local.client.open(path, method=method, json=body, headers=headers)
+        response.close()
+        return response.status_code
+
+    return send
+
+
+def http_sender(port):
+    def send(method, path, body, headers):
+        # sync-воркер gunicorn закрывает соединение после ответа — новое на каждый запрос
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        try:
+            payload = json.dumps(body) if body is not None else None
+            if payload is not None:
+                headers = dict(headers, **{"Content-Type": "application/json"})
+            # http.client не кодирует кириллицу в пути сам, в отличие от test client
+            conn.request(method, quote(path, safe="/?&="), body=payload, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        finally:
+            conn.close()
+
+    return send
+
+
+def start_gunicorn(workers, threads):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    command = [sys.executable, "-m", "gunicorn", "--chdir", ROOT, "-b", f"127.0.0.1:{port}",
+               "-w", str(workers), "--threads", str(threads), "app:app"]
+    process = subprocess.Popen(command, env=os.environ.copy(),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {process.returncode}")
+        try:
+            if http_sender(port)("GET", "/users/available?username=warmup", None, {}) == 200:
+                return process, port
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("gunicorn did not start within 60s")
+
+
+def login():
+    # Токен администратора для маршрутов записи: JWT проверяется без обращения к воркеру, подходит и для gunicorn
+    from app import app
+
+    with app.test_client() as client:
+        response = client.post("/login", json={"username": "admin", "password": "admin"})
+        return response.get_json()["token"]
+
+
+def run_mode(name, send, routes, args, token):
+    results = {}
+    for route, make_request in routes.items():
+        drive(send, make_request, min(args.concurrency, args.requests), args.concurrency, token)  # прогрев
+        results[route] = summary = drive(send, make_request, args.requests, args.concurrency, token)
+        print(f"{name:9} {route:18} {summary['throughput_rps']:9.1f} rps  p50 {summary['p50_ms']:8.2f}  "
+              f"p95 {summary['p95_ms']:8.2f}  p99 {summary['p99_ms']:8.2f} ms  errors {summary['errors']}")
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Сравнивает с прошлым прогоном: рост p95 или падение rps больше tolerance — регрессия."""
+    regressions = []
+    for mode, routes in results["modes"].items():
+        for route, current in routes.items():
+            previous = baseline.get("modes", {}).get(mode, {}).get(route)
+            if not previous:
+                continue
+            p95_change = current["p95_ms"] / previous["p95_ms"] - 1 if previous["p95_ms"] else 0
+            rps_change = current["throughput_rps"] / previous["throughput_rps"] - 1
+            marker = ""
+            if p95_change > tolerance or rps_change < -tolerance:
+                regressions.append(f"{mode}/{route}")
+                marker = "  REGRESSION"
+            print(f"{mode:9} {route:18} p95 {p95_change:+7.1%}  rps {rps_change:+7.1%}{marker}")
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "-C", ROOT, "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--employees", type=int, default=10000)
+    parser.add_argument("--mode", choices=["client", "gunicorn", "both"], default="both")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=500, help="запросов на маршрут")
+    parser.add_argument("--workers", type=int, default=2, help="воркеров gunicorn")
+    parser.add_argument("--threads", type=int, default=1, help="потоков на воркер gunicorn")
+    parser.add_argument("--routes", help="маршруты через запятую, по умолчанию все")
+    parser.add_argument("--output", help="куда записать результаты в JSON")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение, доля")
+    args = parser.parse_args()
+
+    # Отдельная база и снятые лимиты логина, чтобы бенчмарк мерил маршруты, а не 429
+    os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.gettempdir(), "bench_load.db"))
+    os.environ.setdefault("APP_ENV", "production")
+    os.environ.setdefault("LOGIN_RATE_LIMIT_IP", "1000000000/1")
+    os.environ.setdefault("LOGIN_RATE_LIMIT_USERNAME", "1000000000/1")
+    os.environ.setdefault("PASSWORD_POOL_MAX_PENDING", str(max(8, args.concurrency * 2)))
+
+    ctx = seed_employees(args.employees)
+    routes = build_routes(ctx)
+    if args.routes:
+        selected = args.routes.split(",")
+        unknown = set(selected) - set(routes)
+        if unknown:
+            parser.error(f"unknown routes: {', '.join(sorted(unknown))}; available: {', '.join(routes)}")
+        routes = {name: routes[name] for name in selected}
+    token = login()
+
+    results = {
+        "started_at": datetime.datetime.utcnow().isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "database": os.environ["DATABASE_URL"].split("://")[0],
+        "settings": vars(args),
+        "modes": {}
+    }
+    if args.mode in ("client", "both"):
+        results["modes"]["client"] = run_mode("client", client_sender(), routes, args, token)
+    if args.mode in ("gunicorn", "both"):
+        process, port = start_gunicorn(args.workers, args.threads)
+        try:
+            results["modes"]["gunicorn"] = run_mode("gunicorn", http_sender(port), routes, args, token)
+        finally:
+            process.terminate()
+            process.wait()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"results written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        for key in ("employees", "concurrency", "workers", "threads"):
+            if baseline.get("settings", {}).get(key) != getattr(args, key):
+                print(f"warning: {key} differs from baseline, results are not directly comparable")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Микробенчмарк require_auth: jwt.decode на каждый запрос против кэша проверенных токенов.
+
+Запуск из корня репозитория:
+    python bench/token_cache.py [--iterations 20000]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import datetime  # noqa: E402
+
+import jwt  # noqa: E402
+
+from app import app, require_auth, token_cache, SECRET_KEY  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    token = jwt.encode({
+        "user_id": 1,
+        "exp": datetime.datetime.utcnow() + datetime.timedelta(hours=2)
+    }, SECRET_KEY, algorithm="HS256")
+    protected = require_auth(lambda: "ok")
+    headers = {"Authorization": f"Bearer {token}"}
+
+    def run(maxsize):
+        token_cache.maxsize = maxsize
+        token_cache.discard(token)
+        with app.test_request_context(headers=headers):
+            protected()  # прогрев
+            seconds = timeit.timeit(protected, number=args.iterations)
+        return seconds / args.iterations * 1e6
+
+    uncached = run(0)
+    cached = run(10000)
+    print(f"jwt.decode every request: {uncached:8.2f} us/request")
+    print(f"verified-token cache:     {cached:8.2f} us/request")
+    print(f"saved per request:        {uncached - cached:8.2f} us ({uncached / cached:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()